@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Headless controller benchmark (cbench-style).
+
+Drives the controllers with synthetic EventOFPPacketIn events through
+in-process fake datapaths (no Mininet, OVS or root needed) and reports
+packet-ins/sec, p50/p99 handler latency and flow-mods emitted per new flow.
+
+Usage (from the repository root):
+    python3 bench/controller_bench.py
+    python3 bench/controller_bench.py --targets learning sp --hosts 16
+    python3 bench/controller_bench.py --json bench_output.json
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+
+from ryu.controller import ofp_event
+
+from fake_datapath import (FakeDatapath, Dispatcher, packet_in, host_mac,
+                           arp_request, tcp_frame)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (part directory, module, controller class)
+TARGETS = {
+    "learning": ("part1", "p1_learning", "LearningSwitch"),
+    "sp": ("part2", "p2_l2spf", "ShortestPathController"),
+    "lb": ("part2", "p2bonus_l2spf", "LoadBalancedSPController"),
+    "sp_groups": ("part2", "p2_l2spf_groups", "EcmpGroupSPController"),
+    "l3": ("part3", "p3_l3spf", "L3ShortestPath"),
+}
+
+
+def load_app_class(part, module, cls_name):
+    """Import a controller class from one part of the repo.
+
+    The parts import their helpers by bare name (base, graph_utils, ...) and
+    reuse those names, so each part's modules are dropped from sys.modules
+    again once the class is loaded.
+    """
+    part_dir = os.path.join(REPO_ROOT, part)
+    sys.path.insert(0, part_dir)
+    try:
+        mod = importlib.import_module(module)
+        return getattr(mod, cls_name)
+    finally:
+        sys.path.remove(part_dir)
+        for name, m in list(sys.modules.items()):
+            if (getattr(m, "__file__", None) or "").startswith(part_dir + os.sep):
+                del sys.modules[name]
+
+
+def new_app(cls):
+    """Instantiate a controller quietly (config paths are relative to the repo root)."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = cls()
+    app.logger.setLevel(logging.ERROR)
+    return app
+
+
+def host_ip(i):
+    return "10.0.%d.%d" % (i // 250, i % 250 + 1)
+
+
+# ------------------ scenarios ------------------
+# Each scenario sets up the app, then returns (datapaths, measured events, new flows).
+
+def scenario_learning(app, args):
+    """One switch with --hosts hosts; first packet of every host pair."""
+    dp = FakeDatapath(1, serialize=not args.no_serialize)
+    dispatch = Dispatcher(app)
+    dispatch.connect(dp)
+
+    hosts = range(1, args.hosts + 1)
+    for h in hosts:  # hosts announce themselves (ARP broadcast)
+        dispatch.packet_in(dp, h, arp_request(host_mac(h), host_ip(h), host_ip(0)))
+
+    events = []
+    for a in hosts:
+        for b in hosts:
+            if a != b:
+                data = tcp_frame(host_mac(a), host_mac(b), host_ip(a), host_ip(b), 10000 + b, 80)
+                events.append(packet_in(dp, a, data))
+    return [dp], events, len(events)
+
+
+def _topology_from_config(path):
+    """Switch links from part2's weight_matrix: returns (dpids, {dpid: {nbr: port}})."""
+    with open(path) as f:
+        cfg = json.load(f)
+    nodes = cfg["nodes"]
+    matrix = cfg["weight_matrix"]
+    dpids = [int(n[1:]) for n in nodes]
+    ports = {d: {} for d in dpids}
+    for i, u in enumerate(dpids):
+        for j, v in enumerate(dpids):
+            if i != j and matrix[i][j] and matrix[i][j] > 0:
+                ports[u][v] = len(ports[u]) + 1
+    return dpids, ports
+
+
+def _flood_in_ports(ports, root):
+    """Port each switch first receives a frame flooded from root on (BFS tree)."""
+    in_ports = {}
+    queue = deque([root])
+    seen = {root}
+    while queue:
+        u = queue.popleft()
+        for v in sorted(ports[u]):
+            if v not in seen:
+                seen.add(v)
+                in_ports[v] = ports[v][u]
+                queue.append(v)
+    return in_ports
+
+
+def scenario_sp(app, args):
+    """part2 topology: LLDP discovery, hosts spread over switches, first packet of every host pair."""
+    dpids, ports = _topology_from_config(os.path.join(REPO_ROOT, "part2", "config.json"))
+    dps = {d: FakeDatapath(d, serialize=not args.no_serialize) for d in dpids}
+    dispatch = Dispatcher(app)
+    for dp in dps.values():
+        dispatch.connect(dp)
+
+    # LLDP: deliver each switch's probe to the neighbor at the far end of the link
+    for u in dpids:
+        for v, port in ports[u].items():
+            lldp = app._build_lldp(u, port)
+            lldp.serialize()
+            dispatch.packet_in(dps[v], ports[v][u], bytes(lldp.data))
+
+    # hosts round-robin over switches, after the inter-switch ports
+    location = {}
+    next_port = {d: len(ports[d]) + 1 for d in dpids}
+    for h in range(1, args.hosts + 1):
+        d = dpids[(h - 1) % len(dpids)]
+        location[h] = (d, next_port[d])
+        next_port[d] += 1
+
+    # ARP broadcasts: seen at the host's switch and (flooded) everywhere else
+    for h, (d, port) in location.items():
+        data = arp_request(host_mac(h), host_ip(h), host_ip(0))
+        dispatch.packet_in(dps[d], port, data)
+        for other, in_port in _flood_in_ports(ports, d).items():
+            dispatch.packet_in(dps[other], in_port, data)
+
+    # first packet of every pair, then --dup packet-ins that race its setup
+    # (alternately the same direction and the reply from the other host)
+    events = []
+    new_flows = 0
+    for a, (d, port) in location.items():
+        for b, (d_b, port_b) in location.items():
+            if a != b:
+                data = tcp_frame(host_mac(a), host_mac(b), host_ip(a), host_ip(b), 10000 + b, 80)
+                reply = tcp_frame(host_mac(b), host_mac(a), host_ip(b), host_ip(a), 80, 10000 + b)
+                events.append(packet_in(dps[d], port, data))
+                for i in range(args.dup):
+                    events.append(packet_in(dps[d_b], port_b, reply) if i % 2 else packet_in(dps[d], port, data))
+                new_flows += 1
+    return list(dps.values()), events, new_flows
+
+
+def scenario_l3(app, args):
+    """part3 routers: first packet of --flows TCP flows between the configured hosts."""
+    cfg = app.cfg
+    dps = {s["dpid"]: FakeDatapath(s["dpid"], serialize=not args.no_serialize)
+           for s in cfg["switches"]}
+    dispatch = Dispatcher(app)
+    for dp in dps.values():
+        dispatch.connect(dp)
+
+    # (dpid, port, host, gateway mac) for every host
+    attach = []
+    for h in cfg["hosts"]:
+        sw = app.switches[h["switch"]]
+        iface = next(i for i in sw["interfaces"] if i.get("neighbor") == h["name"])
+        attach.append((sw["dpid"], int(iface["name"].split("eth")[-1]), h, iface["mac"]))
+
+    events = []
+    for n in range(args.flows):
+        dpid, port, src, gw_mac = attach[n % len(attach)]
+        dst = attach[(n + 1) % len(attach)][2]
+        data = tcp_frame(src["mac"], gw_mac, src["ip"], dst["ip"], 10000 + n, 80)
+        events.append(packet_in(dps[dpid], port, data))
+    return list(dps.values()), events, len(events)
+
+
+SCENARIOS = {
+    "learning": scenario_learning,
+    "sp": scenario_sp,
+    "lb": scenario_sp,
+    "sp_groups": scenario_sp,
+    "l3": scenario_l3,
+}
+
+
+# ------------------ measurement ------------------
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[idx]
+
+
+def run_target(name, args):
+    part, module, cls_name = TARGETS[name]
+    app = new_app(load_app_class(part, module, cls_name))
+    dps, events, new_flows = SCENARIOS[name](app, args)
+    for dp in dps:
+        dp.reset()
+
+    dispatch = Dispatcher(app)
+    latencies = []
+    clock = time.perf_counter
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = clock()
+        for ev in events:
+            t0 = clock()
+            dispatch(ofp_event.EventOFPPacketIn, ev)
+            latencies.append(clock() - t0)
+        elapsed = clock() - start
+        for dp in dps:  # let pending setups complete (releases held packets)
+            dispatch.ack_barriers(dp)
+
+    latencies.sort()
+    flow_mods = sum(dp.counts["OFPFlowMod"] for dp in dps)
+    packet_outs = sum(dp.counts["OFPPacketOut"] for dp in dps)
+    result = {
+        "target": name,
+        "controller": cls_name,
+        "packet_ins": len(events),
+        "seconds": elapsed,
+        "packet_ins_per_sec": len(events) / elapsed if elapsed else 0.0,
+        "p50_us": percentile(latencies, 50) * 1e6,
+        "p99_us": percentile(latencies, 99) * 1e6,
+        "flow_mods": flow_mods,
+        "packet_outs": packet_outs,
+        "new_flows": new_flows,
+        "flow_mods_per_flow": flow_mods / new_flows if new_flows else 0.0,
+    }
+    pending = getattr(app, "pending", None)
+    if pending is not None:
+        result["pending"] = pending.stats()
+    return result
+
+
+def print_table(results):
+    header = ("target", "controller", "packet_ins", "pkt_in/s", "p50 us", "p99 us", "flow_mods/flow")
+    rows = [(r["target"], r["controller"], str(r["packet_ins"]),
+             "%.0f" % r["packet_ins_per_sec"], "%.1f" % r["p50_us"], "%.1f" % r["p99_us"],
+             "%.2f" % r["flow_mods_per_flow"]) for r in results]
+    widths = [max(len(str(c)) for c in col) for col in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(c).ljust(w) for c, w in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless controller benchmark (fake datapaths)")
+    parser.add_argument("--targets", nargs="+", choices=sorted(TARGETS), default=list(TARGETS),
+                        help="controllers to benchmark (default: all)")
+    parser.add_argument("--hosts", type=int, default=16,
+                        help="hosts for the L2 scenarios (host pairs = new flows)")
+    parser.add_argument("--flows", type=int, default=500,
+                        help="new flows for the L3 scenario")
+    parser.add_argument("--dup", type=int, default=0,
+                        help="extra packet-ins per new flow racing its setup (sp/lb scenarios)")
+    parser.add_argument("--no-serialize", action="store_true",
+                        help="do not serialize messages on send_msg")
+    parser.add_argument("--json", metavar="FILE", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    os.chdir(REPO_ROOT)
+    logging.disable(logging.WARNING)
+    results = [run_target(name, args) for name in args.targets]
+    print_table(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
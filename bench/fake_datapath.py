@@ -0,0 +1,150 @@
+# fake_datapath.py
+# In-process stand-ins for switches, so Ryu apps can be driven without OVS.
+
+import inspect
+from collections import Counter
+
+from ryu.controller import ofp_event
+from ryu.lib.packet import packet, ethernet, arp, ipv4, tcp
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+
+# OpenFlow message type -> class name, for messages sent as raw bytes
+RAW_MSG_NAMES = {
+    ofproto_v1_3.OFPT_FLOW_MOD: "OFPFlowMod",
+    ofproto_v1_3.OFPT_GROUP_MOD: "OFPGroupMod",
+    ofproto_v1_3.OFPT_PACKET_OUT: "OFPPacketOut",
+    ofproto_v1_3.OFPT_BARRIER_REQUEST: "OFPBarrierRequest",
+}
+
+
+class FakeDatapath(object):
+    """Minimal Datapath: real OF1.3 ofproto/parser, send_msg() just records.
+
+    With serialize=True every message is serialized on send, like the real
+    Datapath does before writing it to the socket, so encoding cost is part
+    of what gets measured.
+    """
+
+    def __init__(self, dpid, serialize=True, n_buffers=0):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.serialize = serialize
+        self.n_buffers = n_buffers
+        self.xid = 0
+        self.sent = []
+        self.counts = Counter()  # message class name -> count
+        self.barriers = []       # xids of barrier requests not answered yet (see Dispatcher.ack_barriers)
+
+    def set_xid(self, msg):
+        self.xid = (self.xid + 1) & 0xffffffff
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        if self.serialize:
+            if msg.xid is None:
+                self.set_xid(msg)
+            msg.serialize()
+        self.sent.append(msg)
+        self.counts[type(msg).__name__] += 1
+        if isinstance(msg, self.ofproto_parser.OFPBarrierRequest):
+            self.barriers.append(msg.xid)
+
+    def send(self, buf):
+        """Raw pre-serialized message (e.g. a compiled flow-mod); counted by its OpenFlow type."""
+        self.sent.append(buf)
+        self.counts[RAW_MSG_NAMES.get(buf[1], "raw")] += 1
+
+    def reset(self):
+        self.sent = []
+        self.counts.clear()
+        self.barriers = []
+
+
+class FakeEvent(object):
+    """Event carrying a single OpenFlow message (what ofp_event.EventOFP* look like to handlers)."""
+
+    def __init__(self, msg):
+        self.msg = msg
+
+
+def switch_features(dp):
+    msg = dp.ofproto_parser.OFPSwitchFeatures(dp)
+    msg.datapath_id = dp.id
+    msg.n_buffers = dp.n_buffers
+    msg.n_tables = 254
+    return FakeEvent(msg)
+
+
+def packet_in(dp, in_port, data, buffer_id=None):
+    ofproto = dp.ofproto
+    if buffer_id is None:
+        buffer_id = ofproto.OFP_NO_BUFFER
+    msg = dp.ofproto_parser.OFPPacketIn(dp, buffer_id=buffer_id, total_len=len(data),
+                                        reason=ofproto.OFPR_NO_MATCH, table_id=0,
+                                        match=dp.ofproto_parser.OFPMatch(in_port=in_port),
+                                        data=data)
+    return FakeEvent(msg)
+
+
+def handlers_for(app, ev_cls):
+    """Bound methods of app registered (via @set_ev_cls) for ev_cls, as Ryu would find them."""
+    return [m for _, m in inspect.getmembers(app, inspect.ismethod)
+            if ev_cls in getattr(m, "callers", {})]
+
+
+class Dispatcher(object):
+    """Delivers events to every handler an app registered for them."""
+
+    def __init__(self, app):
+        self.app = app
+        self._handlers = {}
+
+    def __call__(self, ev_cls, ev):
+        handlers = self._handlers.get(ev_cls)
+        if handlers is None:
+            handlers = self._handlers[ev_cls] = handlers_for(self.app, ev_cls)
+        for handler in handlers:
+            handler(ev)
+
+    def connect(self, dp):
+        self(ofp_event.EventOFPSwitchFeatures, switch_features(dp))
+
+    def packet_in(self, dp, in_port, data):
+        self(ofp_event.EventOFPPacketIn, packet_in(dp, in_port, data))
+
+    def ack_barriers(self, dp):
+        """Answer every outstanding barrier request of dp, oldest first."""
+        xids, dp.barriers = dp.barriers, []
+        for xid in xids:
+            msg = dp.ofproto_parser.OFPBarrierReply(dp)
+            msg.xid = xid
+            self(ofp_event.EventOFPBarrierReply, FakeEvent(msg))
+
+
+# ------------------ synthetic frames ------------------
+def host_mac(i):
+    return "00:00:00:00:%02x:%02x" % ((i >> 8) & 0xff, i & 0xff)
+
+
+def arp_request(src_mac, src_ip, dst_ip):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst="ff:ff:ff:ff:ff:ff", src=src_mac,
+                                       ethertype=0x0806))
+    pkt.add_protocol(arp.arp(opcode=arp.ARP_REQUEST, src_mac=src_mac, src_ip=src_ip,
+                             dst_mac="00:00:00:00:00:00", dst_ip=dst_ip))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def tcp_frame(src_mac, dst_mac, src_ip, dst_ip, src_port, dst_port, payload_len=0):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst=dst_mac, src=src_mac, ethertype=0x0800))
+    pkt.add_protocol(ipv4.ipv4(src=src_ip, dst=dst_ip, proto=6))
+    pkt.add_protocol(tcp.tcp(src_port=src_port, dst_port=dst_port, bits=tcp.TCP_SYN))
+    if payload_len:
+        pkt.add_protocol(b"\x00" * payload_len)
+    pkt.serialize()
+    return bytes(pkt.data)
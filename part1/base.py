@@ -2,6 +2,8 @@
 
 # base Controller class for common functionalities
 
+import itertools
+
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import MAIN_DISPATCHER, CONFIG_DISPATCHER, set_ev_cls
@@ -10,16 +12,85 @@ from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
 from ryu.lib.packet import ether_types
 
+from mac_table import MacTable
+from flow_mirror import FlowMirror
+from rate_limit import TokenBucket
+
 class BaseController(app_manager.RyuApp):
     """Base Controller skeleton for Hub and Learning Switch"""
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION] # openflow version
 
+    MAC_TABLE_CAPACITY = 4096  # max learned MACs per switch (LRU evicted beyond this)
+    MAC_AGING_TIME = 300.0     # seconds before a learned MAC is forgotten
+    FLOW_TABLE_CAPACITY = 1000 # flow entries the switch table can hold
+    FLOW_TABLE_HIGH_WATERMARK = 0.9  # start evicting old flows at this fill level
+
+    # packet-in rate limiting (0 = unlimited). The same budget is enforced by an
+    # OpenFlow meter on the table-miss entry and by a token bucket per switch.
+    PACKET_IN_PPS = 0
+    PACKET_IN_PPS_PER_SWITCH = {}  # dpid -> pps, overrides PACKET_IN_PPS
+    PACKET_IN_BURST = None         # bucket/meter burst in packets (default: 1s worth)
+    PACKET_IN_METER_ID = 2
+
+    # Bytes of each table-miss packet sent to the controller. None sends the
+    # whole frame (OFPCML_NO_BUFFER); a small value (e.g. 128) makes the switch
+    # buffer the frame and send only its headers plus a buffer_id, which is
+    # then reused on packet-out/flow-mod. Switches that cannot buffer report
+    # OFP_NO_BUFFER and the handlers fall back to sending msg.data back.
+    PACKET_IN_MAX_LEN = None
+
     def __init__(self, *args, **kwargs):
         super(BaseController, self).__init__(*args, **kwargs)
         # mac_to_port[switch_dpid][mac] = port
         self.mac_to_port = {}
+        # mac_tables[switch_dpid] = MacTable (bounded + aging, keyed by int MAC)
+        self.mac_tables = {}
+        # flow_mirrors[switch_dpid] = FlowMirror (flows installed with SEND_FLOW_REM)
+        self.flow_mirrors = {}
+        # cookies of flows installed with SEND_FLOW_REM, one per install
+        self.flow_cookies = itertools.count(1)
+        # packet_in_buckets[switch_dpid] = TokenBucket (only for rate-limited switches)
+        self.packet_in_buckets = {}
         print("Hi. Initializing Base Controller class.")
 
+    def get_mac_table(self, dpid):
+        """Return the MAC table of a switch, creating it on first use"""
+        table = self.mac_tables.get(dpid)
+        if table is None:
+            table = MacTable(capacity=self.MAC_TABLE_CAPACITY,
+                             aging_time=self.MAC_AGING_TIME)
+            self.mac_tables[dpid] = table
+        return table
+
+    def get_flow_mirror(self, dpid):
+        """Return the controller-side mirror of a switch's flows"""
+        mirror = self.flow_mirrors.get(dpid)
+        if mirror is None:
+            mirror = FlowMirror(capacity=self.FLOW_TABLE_CAPACITY,
+                                high_watermark=self.FLOW_TABLE_HIGH_WATERMARK)
+            self.flow_mirrors[dpid] = mirror
+        return mirror
+
+    def packet_in_pps(self, dpid):
+        """Packet-in budget (packets/sec) of a switch, 0 if unlimited"""
+        return self.PACKET_IN_PPS_PER_SWITCH.get(dpid, self.PACKET_IN_PPS)
+
+    def admit_packet_in(self, dpid):
+        """False if this switch has used up its packet-in budget (the packet-in should be dropped)"""
+        bucket = self.packet_in_buckets.get(dpid)
+        if bucket is None:
+            pps = self.packet_in_pps(dpid)
+            if not pps:
+                return True
+            bucket = TokenBucket(pps, self.PACKET_IN_BURST)
+            self.packet_in_buckets[dpid] = bucket
+        if bucket.consume():
+            return True
+        if bucket.dropped % 1000 == 1:
+            self.logger.warning("Switch %s over its packet-in budget (%s pps): %d packet-ins dropped",
+                                dpid, bucket.rate, bucket.dropped)
+        return False
+
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         """Install a table-miss flow entry so unmatched packets are sent to controller"""
@@ -30,21 +101,141 @@ class BaseController(app_manager.RyuApp):
         # Match everything (table-miss)
         match = parser.OFPMatch()
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
-                                          ofproto.OFPCML_NO_BUFFER)]
-        self.add_flow(datapath, 0, match, actions)
+                                          self.packet_in_max_len(ofproto))]
+        meter_id = self.add_packet_in_meter(datapath)
+        self.add_flow(datapath, 0, match, actions, meter_id=meter_id)
+
+    def packet_in_max_len(self, ofproto):
+        """max_len for controller-bound output actions (see PACKET_IN_MAX_LEN)"""
+        if self.PACKET_IN_MAX_LEN is None:
+            return ofproto.OFPCML_NO_BUFFER
+        return self.PACKET_IN_MAX_LEN
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
-        """Helper to install a flow on a switch"""
+    def add_packet_in_meter(self, datapath):
+        """Install the meter capping the switch's packet-ins. Returns its id, or None if unlimited"""
+        pps = self.packet_in_pps(datapath.id)
+        if not pps:
+            return None
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+        burst = self.PACKET_IN_BURST if self.PACKET_IN_BURST is not None else pps
+        bands = [parser.OFPMeterBandDrop(rate=pps, burst_size=burst)]
+        meter = parser.OFPMeterMod(datapath=datapath,
+                                   command=ofproto.OFPMC_ADD,
+                                   flags=ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST,
+                                   meter_id=self.PACKET_IN_METER_ID,
+                                   bands=bands)
+        datapath.send_msg(meter)
+        self.logger.info("Switch %s: packet-ins limited to %s pps", datapath.id, pps)
+        return self.PACKET_IN_METER_ID
+
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None,
+                 idle_timeout=0, hard_timeout=0, flags=0,
+                 table_id=0, goto_table=None, meter_id=None, cookie=0):
+        """Helper to install a flow on a switch.
+
+        Flows installed with OFPFF_SEND_FLOW_REM are tracked in the switch's
+        flow mirror until the switch reports them removed. If goto_table is
+        given, matching packets continue in that table after the actions;
+        meter_id rate-limits the flow through that meter. cookie tags the
+        flow for delete_flows_by_cookie (and comes back in FlowRemoved);
+        tracked flows without one get a fresh cookie from flow_cookies.
+        """
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        inst = []
+        if meter_id is not None:
+            inst.append(parser.OFPInstructionMeter(meter_id))
+        if actions:
+            inst.append(parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions))
+        if goto_table is not None:
+            inst.append(parser.OFPInstructionGotoTable(goto_table))
 
-        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        if flags & ofproto.OFPFF_SEND_FLOW_REM:
+            if not cookie:
+                cookie = next(self.flow_cookies)
+            self.track_flow(datapath, priority, match, table_id=table_id, cookie=cookie)
 
-        if buffer_id:
+        # buffer_id 0 is a valid switch buffer
+        if buffer_id is not None and buffer_id != ofproto.OFP_NO_BUFFER:
             mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
+                                    table_id=table_id, cookie=cookie,
                                     priority=priority, match=match,
-                                    instructions=inst)
+                                    instructions=inst,
+                                    idle_timeout=idle_timeout,
+                                    hard_timeout=hard_timeout,
+                                    flags=flags)
         else:
-            mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                    match=match, instructions=inst)
+            mod = parser.OFPFlowMod(datapath=datapath, table_id=table_id,
+                                    cookie=cookie, priority=priority,
+                                    match=match, instructions=inst,
+                                    idle_timeout=idle_timeout,
+                                    hard_timeout=hard_timeout,
+                                    flags=flags)
         datapath.send_msg(mod)
+
+    def delete_flow(self, datapath, priority, match, table_id=0):
+        """Remove exactly one flow (same table, priority and match) from a switch"""
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, table_id=table_id,
+                                command=ofproto.OFPFC_DELETE_STRICT,
+                                out_port=ofproto.OFPP_ANY,
+                                out_group=ofproto.OFPG_ANY,
+                                priority=priority, match=match)
+        datapath.send_msg(mod)
+
+    def delete_flows_for_mac(self, datapath, mac):
+        """Remove every flow (any table) matching mac as eth_src or eth_dst, and nothing else
+
+        Their flow mirror entries go at once, so flows re-installed right
+        after (e.g. for a moved host) are tracked on their own.
+        """
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mirror = self.flow_mirrors.get(datapath.id)
+        if mirror is not None:
+            mirror.remove_mac(mac)
+        for match in (parser.OFPMatch(eth_src=mac), parser.OFPMatch(eth_dst=mac)):
+            mod = parser.OFPFlowMod(datapath=datapath, table_id=ofproto.OFPTT_ALL,
+                                    command=ofproto.OFPFC_DELETE,
+                                    out_port=ofproto.OFPP_ANY,
+                                    out_group=ofproto.OFPG_ANY,
+                                    match=match)
+            datapath.send_msg(mod)
+
+    def delete_flows_by_cookie(self, datapath, cookie, table_id=0):
+        """Remove every flow of a table installed with this cookie"""
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=datapath, table_id=table_id,
+                                command=ofproto.OFPFC_DELETE,
+                                cookie=cookie, cookie_mask=0xffffffffffffffff,
+                                out_port=ofproto.OFPP_ANY,
+                                out_group=ofproto.OFPG_ANY,
+                                match=parser.OFPMatch())
+        datapath.send_msg(mod)
+
+    def track_flow(self, datapath, priority, match, table_id=0, cookie=0):
+        """Record a flow in the mirror, evicting the oldest ones if the table is nearly full"""
+        mirror = self.get_flow_mirror(datapath.id)
+        if mirror.near_capacity():
+            victims = mirror.evict()
+            self.logger.info("Switch %s flow table near capacity (%d/%d): evicting %d oldest flows",
+                             datapath.id, len(mirror) + len(victims), mirror.capacity, len(victims))
+            for v_table, v_priority, v_match in victims:
+                self.delete_flow(datapath, v_priority, v_match, table_id=v_table)
+        mirror.add(table_id, priority, match, cookie)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        """Keep the flow mirror in sync with flows the switch timed out or deleted"""
+        msg = ev.msg
+        dpid = msg.datapath.id
+        mirror = self.flow_mirrors.get(dpid)
+        if mirror is None:
+            return
+        if mirror.remove(msg.table_id, msg.priority, msg.match, msg.cookie):
+            self.logger.debug("Switch %s removed flow %s (reason %s, %d packets)",
+                              dpid, msg.match, msg.reason, msg.packet_count)
@@ -0,0 +1,99 @@
+# flow_mirror.py
+# Controller-side mirror of the flows installed on one switch.
+
+import time
+from collections import OrderedDict
+
+
+def match_key(table_id, priority, match):
+    """Hashable key identifying a flow entry (table, priority, match fields)."""
+    return (table_id, priority, tuple(sorted(match.items())))
+
+
+class FlowMirror(object):
+    """Tracks the flows installed on a switch, oldest first.
+
+    Entries are added when the controller installs a flow with
+    OFPFF_SEND_FLOW_REM and dropped again when the switch reports the flow
+    removed (idle/hard timeout or delete). Each entry keeps the cookie of its
+    install, so a late removal of an older flow with the same match does not
+    drop the entry of the flow that replaced it. When the mirror reaches
+    high_watermark * capacity, evict() picks the oldest flows to delete so
+    the switch table stays below its limit.
+    """
+
+    def __init__(self, capacity=1000, high_watermark=0.9, clock=time.monotonic):
+        self.capacity = capacity
+        self.high_watermark = high_watermark
+        self.clock = clock
+        self.flows = OrderedDict()  # key -> (table_id, priority, match, cookie, installed_at)
+
+        # counters
+        self.installed = 0
+        self.removed = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.flows)
+
+    def __contains__(self, key):
+        return key in self.flows
+
+    def add(self, table_id, priority, match, cookie=0):
+        """Record an installed flow and return its key."""
+        key = match_key(table_id, priority, match)
+        if key in self.flows:
+            # re-installed (e.g. after a race with its timeout): now the newest
+            self.flows.move_to_end(key)
+        else:
+            self.installed += 1
+        self.flows[key] = (table_id, priority, match, cookie, self.clock())
+        return key
+
+    def remove(self, table_id, priority, match, cookie=None):
+        """Forget a flow the switch removed. Returns True if it was tracked.
+
+        With cookie, the entry is only dropped if it was installed with that
+        cookie (otherwise the removed flow was an older one, already replaced).
+        """
+        key = match_key(table_id, priority, match)
+        entry = self.flows.get(key)
+        if entry is None or (cookie is not None and entry[3] != cookie):
+            return False
+        del self.flows[key]
+        self.removed += 1
+        return True
+
+    def remove_mac(self, mac):
+        """Forget every flow matching mac as eth_src or eth_dst. Returns how many."""
+        fields = (("eth_src", mac), ("eth_dst", mac))
+        keys = [key for key in self.flows if any(f in key[2] for f in fields)]
+        for key in keys:
+            del self.flows[key]
+        self.removed += len(keys)
+        return len(keys)
+
+    def near_capacity(self):
+        return len(self.flows) >= self.capacity * self.high_watermark
+
+    def evict(self):
+        """Pop the oldest flows until below the watermark.
+
+        Returns the evicted (table_id, priority, match) entries; the caller
+        is responsible for deleting them from the switch.
+        """
+        victims = []
+        while self.flows and self.near_capacity():
+            _, (table_id, priority, match, _, _) = self.flows.popitem(last=False)
+            victims.append((table_id, priority, match))
+        self.evicted += len(victims)
+        return victims
+
+    def stats(self):
+        return {
+            "size": len(self.flows),
+            "capacity": self.capacity,
+            "installed": self.installed,
+            "removed": self.removed,
+            "evicted": self.evicted,
+        }
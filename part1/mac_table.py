@@ -0,0 +1,110 @@
+# mac_table.py
+# Bounded, aging MAC -> port table (one per datapath).
+
+import time
+from collections import OrderedDict
+
+
+def mac_to_int(mac):
+    """Convert a MAC (6 raw bytes or 'aa:bb:cc:dd:ee:ff') into a 48-bit int."""
+    if isinstance(mac, str):
+        return int(mac.replace(":", ""), 16)
+    return int.from_bytes(mac, "big")
+
+
+def int_to_mac(value):
+    """Convert a 48-bit int back into 'aa:bb:cc:dd:ee:ff' form."""
+    return value.to_bytes(6, "big").hex(":")
+
+
+class MacTable(object):
+    """MAC learning table with a fixed capacity, LRU eviction and per-entry aging.
+
+    Keys are 48-bit integer MACs, values are (port, last_seen) tuples kept in
+    LRU order (least recently used first).
+    """
+
+    def __init__(self, capacity=4096, aging_time=300.0, clock=time.monotonic):
+        self.capacity = capacity
+        self.aging_time = aging_time  # seconds; 0/None disables aging
+        self.clock = clock
+        self.entries = OrderedDict()  # mac(int) -> (port, last_seen)
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, mac):
+        return mac in self.entries
+
+    def _is_stale(self, last_seen, now):
+        return bool(self.aging_time) and now - last_seen > self.aging_time
+
+    def learn(self, mac, port, now=None):
+        """Record that mac was seen on port. Returns the previous port (or None)."""
+        if now is None:
+            now = self.clock()
+        entries = self.entries
+        old = entries.get(mac)
+        entries[mac] = (port, now)
+        if old is not None:
+            entries.move_to_end(mac)
+            return old[0]
+
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+        return None
+
+    def lookup(self, mac, now=None):
+        """Return the port for mac, or None if unknown or aged out."""
+        entry = self.entries.get(mac)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if now is None:
+            now = self.clock()
+        if self._is_stale(entry[1], now):
+            del self.entries[mac]
+            self.expired += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(mac)
+        self.hits += 1
+        return entry[0]
+
+    def remove(self, mac):
+        """Forget mac. Returns its port (or None if it was not known)."""
+        entry = self.entries.pop(mac, None)
+        return entry[0] if entry else None
+
+    def expire(self, now=None):
+        """Drop every aged-out entry and return the list of removed MACs."""
+        if not self.aging_time:
+            return []
+        if now is None:
+            now = self.clock()
+        stale = [mac for mac, (_, seen) in self.entries.items()
+                 if self._is_stale(seen, now)]
+        for mac in stale:
+            del self.entries[mac]
+        self.expired += len(stale)
+        return stale
+
+    def stats(self):
+        """Return the table size and hit/miss/eviction/expiry counters."""
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
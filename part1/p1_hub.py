@@ -1,19 +1,73 @@
 from base import BaseController
+from packet_utils import parse_headers
 
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import MAIN_DISPATCHER, CONFIG_DISPATCHER, set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet
-from ryu.lib.packet import ethernet
 from ryu.lib.packet import ether_types
 
 
 class HubController(BaseController):
-    """Hub Controller: Floods all packets (acts like a hub)"""
+    """Hub Controller: Floods all packets (acts like a hub)
+
+    By default every frame goes to the controller and back (OFPPacketOut).
+    With DATAPLANE_FLOOD set, a match-all OFPP_FLOOD rule is installed at
+    connect time instead, so the switch floods on its own. MIRROR_TO_CONTROLLER
+    additionally sends a copy of the traffic to the controller for
+    observation, capped at MIRROR_RATE_PPS by an OpenFlow meter:
+      - table 0: match-all -> flood, goto table 1
+      - table 1: match-all -> meter MIRROR_METER_ID, output CONTROLLER
+    """
+
+    DATAPLANE_FLOOD = False
+    MIRROR_TO_CONTROLLER = False
+    MIRROR_RATE_PPS = 100      # max mirrored packets/sec per switch
+    MIRROR_METER_ID = 1
+    MIRROR_TABLE = 1
 
     def __init__(self, *args, **kwargs):
         super(HubController, self).__init__(*args, **kwargs)
+        self.mirrored_packets = {}  # dpid -> mirror copies received
+
+    @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
+    def switch_features_handler(self, ev):
+        """Install the table-miss entry, plus the flood (and mirror) rules in DATAPLANE_FLOOD mode"""
+        super(HubController, self).switch_features_handler(ev)
+        if not self.DATAPLANE_FLOOD:
+            return
+
+        datapath = ev.msg.datapath
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        match = parser.OFPMatch()
+        actions = [parser.OFPActionOutput(ofproto.OFPP_FLOOD)]
+
+        if not self.MIRROR_TO_CONTROLLER:
+            self.add_flow(datapath, 1, match, actions)
+            self.logger.info("Hub: installed data-plane flood rule on switch %s", datapath.id)
+            return
+
+        # meter limiting the mirrored copies (the flood itself is not metered)
+        bands = [parser.OFPMeterBandDrop(rate=self.MIRROR_RATE_PPS, burst_size=0)]
+        meter = parser.OFPMeterMod(datapath=datapath,
+                                   command=ofproto.OFPMC_ADD,
+                                   flags=ofproto.OFPMF_PKTPS,
+                                   meter_id=self.MIRROR_METER_ID,
+                                   bands=bands)
+        datapath.send_msg(meter)
+
+        self.add_flow(datapath, 1, match, actions, goto_table=self.MIRROR_TABLE)
+
+        inst = [parser.OFPInstructionMeter(self.MIRROR_METER_ID),
+                parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
+                                             [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                                                     ofproto.OFPCML_NO_BUFFER)])]
+        mod = parser.OFPFlowMod(datapath=datapath, table_id=self.MIRROR_TABLE,
+                                priority=0, match=match, instructions=inst)
+        datapath.send_msg(mod)
+        self.logger.info("Hub: installed data-plane flood rule on switch %s (mirror capped at %s pps)",
+                         datapath.id, self.MIRROR_RATE_PPS)
 
     # when packet arrives
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
@@ -24,9 +78,11 @@ class HubController(BaseController):
         parser = datapath.ofproto_parser
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        if not self.admit_packet_in(datapath.id):
+            return
+
+        eth = parse_headers(msg.data)
+        if eth is None or eth.ethertype == ether_types.ETH_TYPE_LLDP:
             # Ignore LLDP packets used for topology discovery
             return
 
@@ -34,6 +90,13 @@ class HubController(BaseController):
         src = eth.src
         dpid = datapath.id
 
+        if self.DATAPLANE_FLOOD:
+            # the switch already flooded this frame; this is only a mirror copy
+            self.mirrored_packets[dpid] = self.mirrored_packets.get(dpid, 0) + 1
+            self.logger.debug("Hub: mirrored %s -> %s on switch %s port %s",
+                              src, dst, dpid, in_port)
+            return
+
         # Initialize table for this switch if not exists
         self.mac_to_port.setdefault(dpid, {})
 
@@ -0,0 +1,8 @@
+from p1_hub import HubController
+
+
+class DataplaneHubController(HubController):
+    """Hub Controller that floods in the data plane and mirrors a rate-limited copy to the controller"""
+
+    DATAPLANE_FLOOD = True
+    MIRROR_TO_CONTROLLER = True
@@ -1,15 +1,65 @@
 from base import BaseController
+from packet_utils import parse_headers
+from mac_table import mac_to_int
 
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import MAIN_DISPATCHER, CONFIG_DISPATCHER, set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet
-from ryu.lib.packet import ethernet
 from ryu.lib.packet import ether_types
 
 class LearningSwitch(BaseController):
-    """Learning Switch: Learns MAC-port mapping and installs flows"""
+    """Learning Switch: Learns MAC-port mapping and installs flows
+
+    By default flows match (in_port, eth_src, eth_dst), i.e. one entry per
+    host pair. With DST_ONLY set, the switch instead uses two tables:
+      - SRC_TABLE (0): eth_src + in_port of every learned host -> goto FWD_TABLE;
+        a miss here (new or moved source) goes to the controller.
+      - FWD_TABLE (1): eth_dst of every learned host -> output port;
+        a miss here (destination not learned yet) floods.
+    This costs O(N) flow entries and packet-ins per switch instead of O(N^2).
+    A host's two rules share a cookie and are removed together: when either
+    times out or is evicted, the other is deleted too, so the host's next
+    frame goes to the controller and both are installed again.
+    """
+
+    FLOW_IDLE_TIMEOUT = 30   # seconds without traffic before a flow expires (0 = never)
+    FLOW_HARD_TIMEOUT = 300  # seconds before a flow expires regardless (0 = never)
+
+    DST_ONLY = False  # aggregate forwarding on eth_dst (see class docstring)
+    SRC_TABLE = 0
+    FWD_TABLE = 1
+
+    @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
+    def switch_features_handler(self, ev):
+        """Install the table-miss entry (and the forwarding table's flood entry in DST_ONLY mode)"""
+        super(LearningSwitch, self).switch_features_handler(ev)
+        if not self.DST_ONLY:
+            return
+
+        datapath = ev.msg.datapath
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        # unknown destination: flood in the data plane, no packet-in
+        actions = [parser.OFPActionOutput(ofproto.OFPP_FLOOD)]
+        self.add_flow(datapath, 0, parser.OFPMatch(), actions, table_id=self.FWD_TABLE)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        """Sync the flow mirror; in DST_ONLY mode also delete the other rule of the host's pair"""
+        super(LearningSwitch, self).flow_removed_handler(ev)
+        msg = ev.msg
+        if not self.DST_ONLY or not msg.cookie:
+            return
+        if msg.table_id == self.SRC_TABLE:
+            other = self.FWD_TABLE
+        elif msg.table_id == self.FWD_TABLE:
+            other = self.SRC_TABLE
+        else:
+            return
+        # a no-op if the partner is already gone or was re-installed (new cookie)
+        self.delete_flows_by_cookie(msg.datapath, msg.cookie, table_id=other)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
@@ -19,22 +69,29 @@ class LearningSwitch(BaseController):
         parser = datapath.ofproto_parser
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        if not self.admit_packet_in(datapath.id):
+            return
+
+        eth = parse_headers(msg.data)
+        if eth is None or eth.ethertype == ether_types.ETH_TYPE_LLDP:
+            return
+
+        if self.DST_ONLY:
+            self._learn_dst_only(msg, in_port, eth)
             return
 
         dst = eth.dst
         src = eth.src
         dpid = datapath.id
-        self.mac_to_port.setdefault(dpid, {})
+        mac_table = self.get_mac_table(dpid)
 
-        # controller the source MAC → port mapping
-        self.mac_to_port[dpid][src] = in_port
+        # controller learns the source MAC → port mapping
+        old_port = mac_table.learn(mac_to_int(eth.src_bin), in_port)
+        if old_port is not None and old_port != in_port:
+            self._host_moved(datapath, src, old_port, in_port)
 
-        if dst in self.mac_to_port[dpid]:
-            out_port = self.mac_to_port[dpid][dst]
-        else:
+        out_port = mac_table.lookup(mac_to_int(eth.dst_bin))
+        if out_port is None:
             out_port = ofproto.OFPP_FLOOD
 
         actions = [parser.OFPActionOutput(out_port)]
@@ -42,11 +99,15 @@ class LearningSwitch(BaseController):
         # Install flow rule if destination is known
         if out_port != ofproto.OFPP_FLOOD:
             match = parser.OFPMatch(in_port=in_port, eth_dst=dst, eth_src=src)
+            # timed-out flows are reported back so the flow mirror stays in sync
+            flow_kwargs = dict(idle_timeout=self.FLOW_IDLE_TIMEOUT,
+                               hard_timeout=self.FLOW_HARD_TIMEOUT,
+                               flags=ofproto.OFPFF_SEND_FLOW_REM)
             if msg.buffer_id != ofproto.OFP_NO_BUFFER:
-                self.add_flow(datapath, 1, match, actions, msg.buffer_id)
+                self.add_flow(datapath, 1, match, actions, msg.buffer_id, **flow_kwargs)
                 return
             else:
-                self.add_flow(datapath, 1, match, actions)
+                self.add_flow(datapath, 1, match, actions, **flow_kwargs)
 
     
         out = parser.OFPPacketOut(datapath=datapath,
@@ -55,3 +116,44 @@ class LearningSwitch(BaseController):
                                   actions=actions,
                                   data=msg.data if msg.buffer_id == ofproto.OFP_NO_BUFFER else None)
         datapath.send_msg(out)
+
+    def _host_moved(self, datapath, mac, old_port, new_port):
+        """A learned MAC showed up on another port: drop only the flows that reference it"""
+        self.logger.info("Host %s moved on switch %s: port %s -> %s, invalidating its flows",
+                         mac, datapath.id, old_port, new_port)
+        self.delete_flows_for_mac(datapath, mac)
+
+    def _learn_dst_only(self, msg, in_port, eth):
+        """DST_ONLY mode: learn the source, install its two rules and forward the packet"""
+        datapath = msg.datapath
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        mac_table = self.get_mac_table(datapath.id)
+
+        old_port = mac_table.learn(mac_to_int(eth.src_bin), in_port)
+        if old_port is not None and old_port != in_port:
+            self._host_moved(datapath, eth.src, old_port, in_port)
+
+        flow_kwargs = dict(idle_timeout=self.FLOW_IDLE_TIMEOUT,
+                           hard_timeout=self.FLOW_HARD_TIMEOUT,
+                           flags=ofproto.OFPFF_SEND_FLOW_REM,
+                           cookie=next(self.flow_cookies))  # shared by the host's two rules
+        # packets *to* this host: one rule per MAC, whoever sends them
+        self.add_flow(datapath, 1, parser.OFPMatch(eth_dst=eth.src),
+                      [parser.OFPActionOutput(in_port)],
+                      table_id=self.FWD_TABLE, **flow_kwargs)
+        # packets *from* this host on this port are known: skip the controller.
+        # If the host moves, this rule no longer matches and it is re-learned.
+        self.add_flow(datapath, 1, parser.OFPMatch(in_port=in_port, eth_src=eth.src), [],
+                      table_id=self.SRC_TABLE, goto_table=self.FWD_TABLE,
+                      **flow_kwargs)
+
+        out_port = mac_table.lookup(mac_to_int(eth.dst_bin))
+        if out_port is None:
+            out_port = ofproto.OFPP_FLOOD
+        out = parser.OFPPacketOut(datapath=datapath,
+                                  buffer_id=msg.buffer_id,
+                                  in_port=in_port,
+                                  actions=[parser.OFPActionOutput(out_port)],
+                                  data=msg.data if msg.buffer_id == ofproto.OFP_NO_BUFFER else None)
+        datapath.send_msg(out)
@@ -0,0 +1,7 @@
+from p1_learning import LearningSwitch
+
+
+class DstLearningSwitch(LearningSwitch):
+    """Learning Switch with destination-MAC-only (aggregated) forwarding"""
+
+    DST_ONLY = True
@@ -6,8 +6,19 @@ Script to start Mininet with the custom topology and test Ryu controllers.
 Usage:
     sudo python3 p1_test.py hub
     sudo python3 p1_test.py learning
+
+Non-interactive benchmark (starts ryu-manager itself, once per controller,
+and compares hub vs learning switch):
+    sudo python3 p1_test.py bench
+    sudo python3 p1_test.py bench --streams 1 2 4 8 --duration 5 --out p1_report
 """
 
+import argparse
+import csv
+import json
+import os
+import re
+import subprocess
 import sys
 import time
 from mininet.net import Mininet
@@ -16,20 +27,17 @@ from mininet.cli import CLI
 from mininet.log import setLogLevel, info
 from p1_topo import CustomTopo
 
+PART1_DIR = os.path.dirname(os.path.abspath(__file__))
 
-def run_test(controller_type):
-    """Start Mininet, attach to Ryu, run tests."""
-    setLogLevel("info")
+# controller name -> Ryu app run by the benchmark
+BENCH_CONTROLLERS = {
+    "hub": os.path.join(PART1_DIR, "p1_hub.py"),
+    "learning": os.path.join(PART1_DIR, "p1_learning.py"),
+}
 
-    # Choose controller name for logging
-    if controller_type == "hub":
-        info("*** Testing Hub Controller\n")
-    elif controller_type == "learning":
-        info("*** Testing Learning Switch Controller\n")
-    else:
-        sys.exit("Usage: sudo python3 p1_test.py [hub|learning]")
 
-    # Setup topology
+def build_net():
+    """Build and start the topology, attached to the controller on 127.0.0.1:6633."""
     topo = CustomTopo()
     net = Mininet(
         topo=topo,
@@ -50,6 +58,23 @@ def run_test(controller_type):
 
     net.build()
     net.start()
+    return net
+
+
+def run_test(controller_type):
+    """Start Mininet, attach to Ryu, run tests."""
+    setLogLevel("info")
+
+    # Choose controller name for logging
+    if controller_type == "hub":
+        info("*** Testing Hub Controller\n")
+    elif controller_type == "learning":
+        info("*** Testing Learning Switch Controller\n")
+    else:
+        sys.exit("Usage: sudo python3 p1_test.py [hub|learning|bench]")
+
+    # Setup topology
+    net = build_net()
 
     # info("*** Running pingall test\n")
     # net.pingAll()
@@ -64,8 +89,158 @@ def run_test(controller_type):
     net.stop()
 
 
+# ------------------ benchmark ------------------
+def controller_packet_ins(net):
+    """Packets the switches sent to the controller (n_packets of controller-bound flows)."""
+    total = 0
+    for sw in net.switches:
+        out = sw.dpctl("dump-flows", "-O", "OpenFlow13")
+        for line in out.splitlines():
+            if "CONTROLLER" in line:
+                m = re.search(r"n_packets=(\d+)", line)
+                if m:
+                    total += int(m.group(1))
+    return total
+
+
+def pingall_latency(net):
+    """pingAllFull summary: loss % and min/avg/max of per-pair average RTT (ms)."""
+    results = net.pingAllFull()
+    sent = received = 0
+    rtts = []
+    for _src, _dst, (p_sent, p_recv, _rttmin, rttavg, _rttmax, _rttdev) in results:
+        sent += p_sent
+        received += p_recv
+        if p_recv:
+            rtts.append(rttavg)
+    return {
+        "loss_pct": 100.0 * (sent - received) / sent if sent else 100.0,
+        "rtt_min_ms": min(rtts) if rtts else None,
+        "rtt_avg_ms": sum(rtts) / len(rtts) if rtts else None,
+        "rtt_max_ms": max(rtts) if rtts else None,
+    }
+
+
+def parse_iperf_mbps(output):
+    """Throughput in Mbit/s from iperf (2) client output: the [SUM] line if present, else the last report."""
+    rates = re.findall(r"^(\[SUM\]|\[\s*\d+\]).*?([\d.]+)\s+([KMG])bits/sec", output, re.M)
+    if not rates:
+        return None
+    sums = [r for r in rates if r[0] == "[SUM]"]
+    _, value, unit = (sums or rates)[-1]
+    return float(value) * {"K": 1e-3, "M": 1.0, "G": 1e3}[unit]
+
+
+def iperf_matrix(net, pairs, streams, duration):
+    """Run iperf for every (client, server) pair and parallel-stream count."""
+    rows = []
+    port = 5201
+    for client_name, server_name in pairs:
+        client, server = net.get(client_name), net.get(server_name)
+        for n in streams:
+            port += 1
+            server.cmd("iperf -s -p %d > /dev/null 2>&1 &" % port)
+            time.sleep(0.5)
+            out = client.cmd("iperf -c %s -p %d -P %d -t %d -f m" % (server.IP(), port, n, duration))
+            server.cmd("kill %iperf")
+            rows.append({"client": client_name, "server": server_name,
+                         "streams": n, "mbps": parse_iperf_mbps(out)})
+            info("*** iperf %s -> %s, %d stream(s): %s Mbit/s\n"
+                 % (client_name, server_name, n, rows[-1]["mbps"]))
+    return rows
+
+
+def bench_controller(name, app, args):
+    """Start ryu-manager with app, run pingall + iperf matrix, return the measurements."""
+    info("*** Benchmarking %s controller (%s)\n" % (name, app))
+    log_path = "%s_%s_ryu.log" % (args.out, name)
+    with open(log_path, "w") as log:
+        ryu = subprocess.Popen([args.ryu_manager, app], stdout=log, stderr=subprocess.STDOUT)
+    try:
+        time.sleep(args.controller_wait)
+        net = build_net()
+        try:
+            net.waitConnected()
+            ping = pingall_latency(net)
+            ping_packet_ins = controller_packet_ins(net)
+            iperf = iperf_matrix(net, args.pairs, args.streams, args.duration)
+            total_packet_ins = controller_packet_ins(net)
+        finally:
+            net.stop()
+    finally:
+        ryu.terminate()
+        ryu.wait()
+
+    return {
+        "controller": name,
+        "ping": ping,
+        "packet_ins_pingall": ping_packet_ins,
+        "packet_ins_total": total_packet_ins,
+        "iperf": iperf,
+    }
+
+
+def write_report(results, out):
+    """Write <out>.json (everything) and <out>.csv (one row per iperf run)."""
+    with open(out + ".json", "w") as f:
+        json.dump(results, f, indent=2)
+
+    with open(out + ".csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["controller", "client", "server", "streams", "mbps",
+                         "ping_rtt_avg_ms", "ping_loss_pct", "packet_ins_total"])
+        for r in results:
+            for row in r["iperf"]:
+                writer.writerow([r["controller"], row["client"], row["server"], row["streams"],
+                                 row["mbps"], r["ping"]["rtt_avg_ms"], r["ping"]["loss_pct"],
+                                 r["packet_ins_total"]])
+
+
+def print_comparison(results):
+    """Side-by-side table: one row per iperf run, one throughput column per controller."""
+    names = [r["controller"] for r in results]
+    fmt = lambda v, spec: "-" if v is None else spec % v
+
+    print("\n%-24s" % "" + "".join("%14s" % n for n in names))
+    print("%-24s" % "ping avg RTT (ms)" + "".join("%14s" % fmt(r["ping"]["rtt_avg_ms"], "%.3f") for r in results))
+    print("%-24s" % "ping loss (%)" + "".join("%14s" % fmt(r["ping"]["loss_pct"], "%.1f") for r in results))
+    print("%-24s" % "packet-ins (pingall)" + "".join("%14d" % r["packet_ins_pingall"] for r in results))
+    print("%-24s" % "packet-ins (total)" + "".join("%14d" % r["packet_ins_total"] for r in results))
+    for i, row in enumerate(results[0]["iperf"]):
+        label = "%s->%s x%d (Mbit/s)" % (row["client"], row["server"], row["streams"])
+        print("%-24s" % label + "".join("%14s" % fmt(r["iperf"][i]["mbps"], "%.2f") for r in results))
+
+
+def run_bench(argv):
+    parser = argparse.ArgumentParser(prog="p1_test.py bench",
+                                     description="Non-interactive hub vs learning switch benchmark")
+    parser.add_argument("--controllers", nargs="+", choices=sorted(BENCH_CONTROLLERS),
+                        default=["hub", "learning"])
+    parser.add_argument("--pairs", nargs="+", default=["h1:h3", "h2:h4", "h1:h2"],
+                        help="iperf client:server pairs")
+    parser.add_argument("--streams", nargs="+", type=int, default=[1, 2, 4],
+                        help="parallel iperf streams (-P) to try for every pair")
+    parser.add_argument("--duration", type=int, default=5, help="seconds per iperf run")
+    parser.add_argument("--out", default="p1_report", help="report path prefix (.json/.csv)")
+    parser.add_argument("--ryu-manager", default="ryu-manager", help="ryu-manager executable")
+    parser.add_argument("--controller-wait", type=float, default=3.0,
+                        help="seconds to let ryu-manager start before building the network")
+    args = parser.parse_args(argv)
+    args.pairs = [tuple(p.split(":")) for p in args.pairs]
+
+    setLogLevel("info")
+    results = [bench_controller(name, BENCH_CONTROLLERS[name], args) for name in args.controllers]
+    write_report(results, args.out)
+    print_comparison(results)
+    info("*** Report written to %s.json and %s.csv\n" % (args.out, args.out))
+
+
 if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        run_bench(sys.argv[2:])
+        sys.exit(0)
+
     if len(sys.argv) != 2:
-        sys.exit("Usage: sudo python3 p1_test.py [hub|learning]")
+        sys.exit("Usage: sudo python3 p1_test.py [hub|learning|bench]")
 
     run_test(sys.argv[1])
@@ -0,0 +1,31 @@
+# rate_limit.py
+# Token bucket used to cap per-switch packet-in processing.
+
+import time
+
+
+class TokenBucket(object):
+    """Classic token bucket: rate tokens/sec, holding at most burst tokens."""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.clock = clock
+        self.tokens = self.burst
+        self.last = clock()
+
+        # counters
+        self.allowed = 0
+        self.dropped = 0
+
+    def consume(self, n=1):
+        """Take n tokens if available. Returns False (and counts a drop) if the bucket ran dry."""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= n:
+            self.tokens -= n
+            self.allowed += 1
+            return True
+        self.dropped += 1
+        return False
@@ -6,7 +6,7 @@ from typing import List
 
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
+from ryu.controller.handler import CONFIG_DISPATCHER, DEAD_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet, ethernet, ether_types
 from ryu.lib import hub
@@ -14,38 +14,123 @@ from ryu.lib.packet import lldp as ryu_lldp
 
 LLDP_ETH_TYPE = 0x88cc
 
-from graph_utils import NetworkGraph
+from flow_templates import (PathProgram, PathProgramCache, flow_class, pack_values,
+                            reverse_fields, send_serialized)
+from graph_utils import load_network_graph
+from packet_utils import parse_headers
+from pending import PendingFlows
+from port_stats import CounterRates
+from rate_limit import TokenBucket
 
 
 class BaseSPController(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
+    # packet-in rate limiting (0 = unlimited). The same budget is enforced by an
+    # OpenFlow meter on the table-miss entry and by a token bucket per switch.
+    PACKET_IN_PPS = 0
+    PACKET_IN_PPS_PER_SWITCH = {}  # dpid -> pps, overrides PACKET_IN_PPS
+    PACKET_IN_BURST = None         # bucket/meter burst in packets (default: 1s worth)
+    PACKET_IN_METER_ID = 1
+
+    # Bytes of each table-miss packet sent to the controller. None sends the
+    # whole frame (OFPCML_NO_BUFFER); a small value (e.g. 128) makes the switch
+    # buffer the frame and send only its headers plus a buffer_id, which is
+    # then reused on packet-out/flow-mod. Switches that cannot buffer report
+    # OFP_NO_BUFFER and the handlers fall back to sending msg.data back.
+    PACKET_IN_MAX_LEN = None
+
+    # Destination-keyed forwarding: one eth_dst rule per host on every switch,
+    # pointing at an OFPGT_SELECT group when there are several equal-cost next
+    # hops, so per-flow ECMP hashing happens in the switch (see install_dst_rules).
+    ECMP_GROUPS = False
+
+    # Push destination-keyed rules for every host as soon as it is learned,
+    # and re-push them on the two switches of every newly discovered link,
+    # instead of waiting for the first packet of each flow.
+    PROACTIVE = False
+
+    # Reactive flow setup: rules go in egress to ingress, followed by a barrier
+    # per switch. The triggering packet, and any packet-ins for the flow that
+    # race the setup (up to PENDING_MAX_QUEUED, then dropped), are held and
+    # sent on once every switch has answered its barrier.
+    PENDING_TIMEOUT = 2.0  # seconds before an unacknowledged setup may be retried
+    PENDING_MAX_QUEUED = 32
+
+    # Compiled path programs (serialized flow-mods per path and flow class, see
+    # program_path) kept for reuse; dropped whenever the adjacency changes.
+    PATH_PROGRAM_CACHE = 1024
+
+    # Topology discovery is event driven: ports come from the PortDesc reply at
+    # switch connect and from PortStatus, and new or changed ports are probed
+    # right away. Live ports are also re-probed as a keepalive, every
+    # LLDP_INTERVAL_MIN seconds after a topology change, backing off (doubling
+    # per quiet round) to LLDP_INTERVAL_MAX while nothing changes.
+    LLDP_INTERVAL_MIN = 1.0
+    LLDP_INTERVAL_MAX = 16.0
+
+    # A link whose LLDP probes go unanswered for this many keepalive rounds
+    # (or whose port goes down) is removed from the adjacency and the graph
+    # until it is discovered again.
+    LINK_TIMEOUT_PROBES = 3
+
+    # Link load from port statistics: every PORT_STATS_INTERVAL seconds (0 =
+    # off) each switch is asked for its port counters, and the EWMA-smoothed
+    # transmit rate of every inter-switch port is written into the graph
+    # (NetworkGraph.set_rate). Loads are relative to the configured edge
+    # capacity, or LINK_CAPACITY_BPS when the config has none.
+    PORT_STATS_INTERVAL = 0
+    PORT_STATS_ALPHA = 0.5
+    LINK_CAPACITY_BPS = 10e6
+
     def __init__(self, *args, **kwargs):
         super(BaseSPController, self).__init__(*args, **kwargs)
         self.logger.setLevel(logging.INFO)
 
         # config + graph
         self.config_path = "./part2/config.json"
-        self.graph = NetworkGraph(self.config_path)
+        self.graph = load_network_graph(self.config_path)
+        self.graph.precompute_all_pairs()  # warm the ECMP path cache
 
         # state
         self.datapaths = {}                # dpid -> datapath
         self.mac_to_port = defaultdict(dict)  # dpid -> {mac:port}
         self.host_location = {}           # mac -> (dpid,port)
         self.adjacency = defaultdict(dict)  # dpid -> {neighbor_dpid: out_port}
+        self.packet_in_buckets = {}        # dpid -> TokenBucket (rate-limited switches only)
+        self.ecmp_groups = {}              # dpid -> {sorted out ports: select group id}
+        self.dst_hosts = set()             # host macs that get destination-keyed rules on every switch
+        self.dst_rules = defaultdict(set)  # dpid -> host macs whose destination rule is installed there
+        self.pending = PendingFlows(self.PENDING_TIMEOUT, self.PENDING_MAX_QUEUED)
+        self.path_programs = PathProgramCache(self.PATH_PROGRAM_CACHE)
+        self.ports = defaultdict(dict)        # dpid -> {port_no: (hw_addr, up)}
+        self.lldp_frames = defaultdict(dict)  # dpid -> {port_no: serialized LLDP packet-out}
 
-        # LLDP thread (runs continuously; will skip until datapaths are present)
-        self.lldp_interval = 2.0  # seconds
+        # LLDP keepalive thread (runs continuously; will skip until datapaths are present)
+        self.lldp_interval = self.LLDP_INTERVAL_MIN  # seconds, adaptive
+        self.topology_dirty = False  # something changed since the last keepalive round
+        self.probe_round = 0         # keepalive rounds so far
+        self.link_seen = {}          # (dpid, dpid) (smaller first) -> probe_round it was last confirmed in
+        self.down_links = {}         # (dpid, dpid) -> graph edge attrs, restored when the link comes back
+        self.lldp_wakeup = hub.Event()
         self.lldp_thread = hub.spawn(self._lldp_loop)
 
+        # port statistics poller
+        self.port_rates = CounterRates(self.PORT_STATS_ALPHA)
+        if self.PORT_STATS_INTERVAL:
+            self.stats_thread = hub.spawn(self._port_stats_loop)
+
     # ------------------ OF helpers ------------------
     def add_flow(self, datapath, priority, match, actions,
-                 buffer_id=None, idle_timeout=0, hard_timeout=0):
+                 buffer_id=None, idle_timeout=0, hard_timeout=0, meter_id=None):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        if meter_id is not None:
+            inst.insert(0, parser.OFPInstructionMeter(meter_id))
 
-        if buffer_id:
+        # buffer_id 0 is a valid switch buffer
+        if buffer_id is not None and buffer_id != ofproto.OFP_NO_BUFFER:
             mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
                                     priority=priority, match=match,
                                     instructions=inst,
@@ -68,6 +153,194 @@ class BaseSPController(app_manager.RyuApp):
                                   data=data if buffer_id == ofproto.OFP_NO_BUFFER else None)
         datapath.send_msg(out)
 
+    # ------------------ Path programming ------------------
+    def program_path(self, path, fields, dpids=None):
+        """Install the flow matching fields along path, plus its reverse, egress to ingress.
+
+        fields are the forward OFPMatch kwargs (see flow_templates.match_fields).
+        The flow-mods come from a PathProgram compiled once per (path, host
+        ports, flow class); later flows only patch their match values in.
+        With dpids, only those switches are programmed. Returns the program.
+        """
+        src_loc = self.host_location.get(fields["eth_src"])
+        dst_loc = self.host_location.get(fields["eth_dst"])
+        src_host_port = src_loc[1] if src_loc else None
+        dst_host_port = dst_loc[1] if dst_loc else None
+        key = (tuple(path), src_host_port, dst_host_port, flow_class(fields))
+        program = self.path_programs.get(key)
+        if program is None:
+            program = self.compile_path(path, fields, src_host_port, dst_host_port)
+            if program.complete:
+                self.path_programs.put(key, program)
+        program.send(self.datapaths, pack_values(fields), pack_values(reverse_fields(fields)), dpids)
+        return program
+
+    def compile_path(self, path, fields, src_host_port, dst_host_port) -> PathProgram:
+        """Build the flow-mod templates of path: on each switch, forward toward the
+        destination host and reverse toward the source host."""
+        rev_fields = reverse_fields(fields)
+        dpids = [int(s[1:]) for s in path]
+        last = len(dpids) - 1
+        program = PathProgram()
+        for i in reversed(range(len(dpids))):
+            cur = dpids[i]
+            dp = self.datapaths.get(cur)
+            links = self.adjacency.get(cur, {})
+            out_port = dst_host_port if i == last else links.get(dpids[i + 1])
+            rev_out = src_host_port if i == 0 else links.get(dpids[i - 1])
+            if dp is None or out_port is None or rev_out is None:
+                program.complete = False
+                self.logger.warning("s%s: incomplete rules for %s (datapath=%s out:%s rev_out:%s)",
+                                    cur, path, dp is not None, out_port, rev_out)
+                if dp is None:
+                    continue
+            if out_port is not None:
+                program.rules.append((self.path_programs.template(dp, out_port, fields), False))
+                if i < last:
+                    program.hops.append((path[i], path[i + 1]))
+            if rev_out is not None:
+                program.rules.append((self.path_programs.template(dp, rev_out, rev_fields), True))
+        return program
+
+    # ------------------ Pending flow setups ------------------
+    def hold_if_pending(self, key, msg, in_port) -> bool:
+        """True if key's rules are still being installed; msg is then queued (or dropped)."""
+        if self.pending.entries:
+            self.expire_pending()
+        entry = self.pending.get(key)
+        if entry is None:
+            return False
+        self.pending.hold(entry, (msg.datapath, in_port, msg.buffer_id, msg.data))
+        return True
+
+    def expire_pending(self):
+        """Give up on entries not acknowledged within PENDING_TIMEOUT.
+
+        Their held packets are still sent on, and their on_expire callback
+        (if any) runs instead of their continuation.
+        """
+        for entry in self.pending.expire():
+            self.logger.warning("%s not acknowledged within %.1fs (%d packets held)",
+                                "Flow setup" if entry.setup else "Barrier step",
+                                self.PENDING_TIMEOUT, len(entry.queued))
+            self._release_pending(entry)
+            on_expire, entry.on_expire = entry.on_expire, None
+            if on_expire is not None:
+                on_expire()
+
+    def start_flow_setup(self, key):
+        """Mark key pending (call before sending its flow-mods; the setup clock starts here)."""
+        return self.pending.start(key)
+
+    def commit_flow_setup(self, entry, path, msg=None, in_port=None):
+        """Barrier every switch of path (egress first) after its flow-mods.
+
+        msg (the packet that triggered the setup) is held and only sent on,
+        through OFPP_TABLE, once every switch has acknowledged, so it cannot
+        overtake a flow-mod still in flight to a downstream switch.
+        """
+        entry.path = tuple(path)
+        if msg is not None:
+            entry.queued.append((msg.datapath, in_port, msg.buffer_id, msg.data))
+        for name in reversed(entry.path):
+            dpid = int(name[1:])
+            dp = self.datapaths.get(dpid)
+            if dp is None or dpid in entry.waiting:
+                continue
+            req = dp.ofproto_parser.OFPBarrierRequest(dp)
+            dp.set_xid(req)
+            dp.send_msg(req)
+            self.pending.expect_barrier(entry, dpid, req.xid)
+        if not entry.waiting:
+            self._complete_pending(self.pending.finish(entry))
+        return entry
+
+    def barrier_then(self, key, dpids, then, on_expire=None):
+        """Barrier each of dpids and call then() once all have answered (at once if none is connected).
+
+        If they have not all answered within PENDING_TIMEOUT, on_expire() is
+        called instead (see expire_pending). The step is not a flow setup and
+        stays out of the setup statistics.
+        """
+        entry = self.pending.start(key, setup=False)
+        entry.then = then
+        entry.on_expire = on_expire
+        return self.commit_flow_setup(entry, [f"s{d}" for d in dpids])
+
+    def path_setup_latency(self, path):
+        """Measured setup latency of path (see PendingFlows.latency), None if never set up."""
+        return self.pending.latency(path)
+
+    def _release_pending(self, entry):
+        """Send the packets held for a flow through the (now installed) flow table."""
+        for dp, in_port, buffer_id, data in entry.queued:
+            actions = [dp.ofproto_parser.OFPActionOutput(dp.ofproto.OFPP_TABLE)]
+            self.send_packet_out(dp, buffer_id, in_port, actions, data)
+        entry.queued = []
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        msg = ev.msg
+        entry = self.pending.barrier_reply(msg.datapath.id, msg.xid)
+        if entry is not None:
+            if entry.setup:
+                self.logger.debug("Flow setup along %s complete in %.1f ms, %d duplicate packet-ins coalesced",
+                                  list(entry.path),
+                                  self.pending.path_latency[entry.path][1] * 1e3, entry.coalesced)
+            self._complete_pending(entry)
+
+    def _complete_pending(self, entry):
+        """Every switch acknowledged: send the held packets, then run the entry's continuation."""
+        self._release_pending(entry)
+        then, entry.then = entry.then, None
+        if then is not None:
+            then()
+
+    # ------------------ Packet-in rate limiting ------------------
+    def packet_in_pps(self, dpid):
+        """Packet-in budget (packets/sec) of a switch, 0 if unlimited."""
+        return self.PACKET_IN_PPS_PER_SWITCH.get(dpid, self.PACKET_IN_PPS)
+
+    def packet_in_max_len(self, ofproto):
+        """max_len for controller-bound output actions (see PACKET_IN_MAX_LEN)."""
+        if self.PACKET_IN_MAX_LEN is None:
+            return ofproto.OFPCML_NO_BUFFER
+        return self.PACKET_IN_MAX_LEN
+
+    def add_packet_in_meter(self, dp):
+        """Install the meter capping the switch's packet-ins. Returns its id, or None if unlimited."""
+        pps = self.packet_in_pps(dp.id)
+        if not pps:
+            return None
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        burst = self.PACKET_IN_BURST if self.PACKET_IN_BURST is not None else pps
+        bands = [parser.OFPMeterBandDrop(rate=pps, burst_size=burst)]
+        meter = parser.OFPMeterMod(datapath=dp,
+                                   command=ofproto.OFPMC_ADD,
+                                   flags=ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST,
+                                   meter_id=self.PACKET_IN_METER_ID,
+                                   bands=bands)
+        dp.send_msg(meter)
+        self.logger.info("Switch %s: packet-ins limited to %s pps", dp.id, pps)
+        return self.PACKET_IN_METER_ID
+
+    def admit_packet_in(self, dpid):
+        """False if this switch has used up its packet-in budget (the packet-in should be dropped)."""
+        bucket = self.packet_in_buckets.get(dpid)
+        if bucket is None:
+            pps = self.packet_in_pps(dpid)
+            if not pps:
+                return True
+            bucket = TokenBucket(pps, self.PACKET_IN_BURST)
+            self.packet_in_buckets[dpid] = bucket
+        if bucket.consume():
+            return True
+        if bucket.dropped % 1000 == 1:
+            self.logger.warning("Switch %s over its packet-in budget (%s pps): %d packet-ins dropped",
+                                dpid, bucket.rate, bucket.dropped)
+        return False
+
     # ------------------ Switch connect ------------------
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
@@ -75,62 +348,176 @@ class BaseSPController(app_manager.RyuApp):
         dpid = dp.id
         self.logger.info("Switch %s connected", dpid)
         self.datapaths[dpid] = dp
+        self.ports.pop(dpid, None)
+        self.lldp_frames.pop(dpid, None)
+        self.dst_rules.pop(dpid, None)
+        self.topology_changed()
 
         # install table-miss
         parser = dp.ofproto_parser
         ofproto = dp.ofproto
         match = parser.OFPMatch()
-        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
-        self.add_flow(dp, 0, match, actions)
+        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, self.packet_in_max_len(ofproto))]
+        meter_id = self.add_packet_in_meter(dp)
+        self.add_flow(dp, 0, match, actions, meter_id=meter_id)
+        if self.ECMP_GROUPS:
+            # start from an empty group table (e.g. after a reconnect)
+            self.ecmp_groups.pop(dpid, None)
+            dp.send_msg(parser.OFPGroupMod(dp, ofproto.OFPGC_DELETE, 0, ofproto.OFPG_ALL))
+        if meter_id is not None:
+            # keep topology discovery out of the packet-in budget
+            lldp_actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
+            self.add_flow(dp, 0xffff, parser.OFPMatch(eth_type=LLDP_ETH_TYPE), lldp_actions)
+        # destination rules (after the group delete, which also flushes the
+        # flows using those groups); switches further away get theirs once
+        # LLDP finds the switch's links
+        for mac in list(self.dst_hosts):
+            self.install_dst_rules(mac, dpids=(dpid,))
 
-        # request port desc right away (this triggers port_desc_handler)
+        # request port desc right away (port_desc_handler probes every port);
+        # after that the port cache follows PortStatus
         req = parser.OFPPortDescStatsRequest(dp, 0)
         dp.send_msg(req)
 
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def state_change_handler(self, ev):
+        dp = ev.datapath
+        if dp.id is None or self.datapaths.get(dp.id) is not dp:
+            return
+        self.logger.info("Switch %s disconnected", dp.id)
+        del self.datapaths[dp.id]
+        self.port_rates.forget(dp.id)
+        for nbr in list(self.adjacency.get(dp.id, {})):
+            self.expire_link(dp.id, nbr, "switch disconnected")
+        self.ports.pop(dp.id, None)
+        self.lldp_frames.pop(dp.id, None)
+        self.dst_rules.pop(dp.id, None)
+        self.topology_changed()
+
     # ------------------ LLDP sending / receiving ------------------
     def _lldp_loop(self):
-        """Periodically request port desc and send LLDP (works even if started early)."""
+        """LLDP keepalive: re-probe every live port, at an interval that adapts to topology churn."""
         while True:
-            if not self.datapaths:
-                hub.sleep(self.lldp_interval)
-                continue
-            # send port description request for every datapath (port_desc_handler will send LLDP)
+            self.lldp_wakeup.wait(timeout=self.lldp_interval)
+            self.lldp_wakeup.clear()
+            self.probe_round += 1
+            self.age_links()
             for dp in list(self.datapaths.values()):
                 try:
-                    parser = dp.ofproto_parser
-                    req = parser.OFPPortDescStatsRequest(dp, 0)
-                    dp.send_msg(req)
+                    self.probe_ports(dp)
                 except Exception as e:
-                    self.logger.exception("Failed sending portdesc req to dpid=%s: %s", dp.id, e)
-            hub.sleep(self.lldp_interval)
+                    self.logger.exception("Failed sending LLDP to dpid=%s: %s", dp.id, e)
+            if self.topology_dirty:
+                self.topology_dirty = False
+                self.lldp_interval = self.LLDP_INTERVAL_MIN
+            else:
+                self.lldp_interval = min(self.lldp_interval * 2, self.LLDP_INTERVAL_MAX)
+
+    def topology_changed(self):
+        """Go back to the fastest keepalive (waking the loop if it was backed off)."""
+        self.topology_dirty = True
+        if self.lldp_interval > self.LLDP_INTERVAL_MIN:
+            self.lldp_interval = self.LLDP_INTERVAL_MIN
+            self.lldp_wakeup.set()
+
+    @staticmethod
+    def port_is_up(ofproto, port) -> bool:
+        return not (port.config & ofproto.OFPPC_PORT_DOWN or port.state & ofproto.OFPPS_LINK_DOWN)
+
+    def update_port(self, dp, port) -> bool:
+        """Record a port's state (from PortDesc or PortStatus). True if it is new or changed."""
+        state = (port.hw_addr, self.port_is_up(dp.ofproto, port))
+        ports = self.ports[dp.id]
+        old = ports.get(port.port_no)
+        if old == state:
+            return False
+        if old is not None and old[0] != state[0]:
+            self.lldp_frames[dp.id].pop(port.port_no, None)  # port was re-created
+        ports[port.port_no] = state
+        return True
+
+    def remove_port(self, dpid, port_no) -> bool:
+        self.lldp_frames[dpid].pop(port_no, None)
+        self.port_rates.forget(dpid, port_no)
+        return self.ports[dpid].pop(port_no, None) is not None
+
+    def send_lldp(self, dp, port_no):
+        """Send dp's LLDP probe out of port_no (cached packet-out, see lldp_packet_out)."""
+        frames = self.lldp_frames[dp.id]
+        buf = frames.get(port_no)
+        if buf is None:
+            buf = frames[port_no] = self.lldp_packet_out(dp, port_no)
+        send_serialized(dp, buf)
+
+    def probe_ports(self, dp):
+        """Send LLDP out of every live port of dp, so neighbors will generate PacketIn."""
+        for port_no, (_, up) in self.ports[dp.id].items():
+            if up:
+                self.send_lldp(dp, port_no)
 
     @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
     def port_desc_handler(self, ev):
-        """When switch reports ports, send LLDP Packets out each port so neighbors will generate PacketIn."""
+        """Switch reported all its ports: refresh the port cache and probe every live port."""
         dp = ev.msg.datapath
         dpid = dp.id
-        parser = dp.ofproto_parser
         ofproto = dp.ofproto
 
         self.logger.debug("PortDesc reply from s%s: %s ports", dpid, len(ev.msg.body))
 
+        seen = set()
         for p in ev.msg.body:
             # skip the LOCAL port
             if p.port_no >= ofproto.OFPP_MAX or p.port_no == ofproto.OFPP_LOCAL:
                 continue
+            seen.add(p.port_no)
+            self.update_port(dp, p)
+
+        # ports the switch no longer reports
+        for port_no in set(self.ports[dpid]) - seen:
+            self.remove_port(dpid, port_no)
+        self.probe_ports(dp)
 
-            # Build LLDP packet carrying (dpid, port_no)
-            lldp_pkt = self._build_lldp(dpid, p.port_no)
-            lldp_pkt.serialize()
-            data = lldp_pkt.data
-            actions = [parser.OFPActionOutput(p.port_no)]
-            out = parser.OFPPacketOut(datapath=dp,
-                                      buffer_id=ofproto.OFP_NO_BUFFER,
-                                      in_port=ofproto.OFPP_CONTROLLER,
-                                      actions=actions,
-                                      data=data)
-            dp.send_msg(out)
-            self.logger.debug("Sent LLDP from s%s port %s", dpid, p.port_no)
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def port_status_handler(self, ev):
+        """Port added, removed or changed state: update the cache and probe the port if it is up."""
+        msg = ev.msg
+        dp = msg.datapath
+        ofproto = dp.ofproto
+        p = msg.desc
+        if p.port_no >= ofproto.OFPP_MAX:
+            return
+
+        if msg.reason == ofproto.OFPPR_DELETE:
+            changed = self.remove_port(dp.id, p.port_no)
+        else:
+            changed = self.update_port(dp, p)
+        if not changed:
+            return
+
+        up = self.ports[dp.id].get(p.port_no, (None, False))[1]
+        self.logger.info("s%s port %s %s", dp.id, p.port_no, "up" if up else "down")
+        self.topology_changed()
+        if up:
+            self.send_lldp(dp, p.port_no)
+        else:
+            for nbr, port in list(self.adjacency.get(dp.id, {}).items()):
+                if port == p.port_no:
+                    self.expire_link(dp.id, nbr, "port down")
+
+    def lldp_packet_out(self, dp, port_no) -> bytes:
+        """Serialized OFPPacketOut sending dp's LLDP probe out of port_no (xid patched on send)."""
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        lldp_pkt = self._build_lldp(dp.id, port_no)
+        lldp_pkt.serialize()
+        out = parser.OFPPacketOut(datapath=dp,
+                                  buffer_id=ofproto.OFP_NO_BUFFER,
+                                  in_port=ofproto.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(port_no)],
+                                  data=lldp_pkt.data)
+        out.set_xid(0)
+        out.serialize()
+        return bytes(out.buf)
 
     def _build_lldp(self, dpid, port_no):
         """Return a Packet() containing LLDP TLVs with chassis=dpid, port=port_no"""
@@ -157,8 +544,7 @@ class BaseSPController(app_manager.RyuApp):
         msg = ev.msg
         dp = msg.datapath
         dpid = dp.id
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
+        eth = parse_headers(msg.data)
 
         if eth is None:
             return
@@ -167,7 +553,7 @@ class BaseSPController(app_manager.RyuApp):
         if eth.ethertype != LLDP_ETH_TYPE:
             return
 
-        lldp_pkt = pkt.get_protocol(ryu_lldp.lldp)
+        lldp_pkt = eth.packet().get_protocol(ryu_lldp.lldp)
         if not lldp_pkt or not hasattr(lldp_pkt, 'tlvs'):
             return
 
@@ -187,11 +573,257 @@ class BaseSPController(app_manager.RyuApp):
         # populate adjacency both ways
         # out port on src_dpid to reach dst_dpid is src_port (when sending)
         # but the local port on dst_dpid which observed it is dst_port
+        new_link = (self.adjacency[src_dpid].get(dst_dpid) != src_port
+                    or self.adjacency[dst_dpid].get(src_dpid) != dst_port)
         self.adjacency[src_dpid][dst_dpid] = src_port
         self.adjacency[dst_dpid][src_dpid] = dst_port
+        self.link_seen[(min(src_dpid, dst_dpid), max(src_dpid, dst_dpid))] = self.probe_round
+        if new_link:
+            self.path_programs.clear()  # compiled out ports may be stale
+            self.topology_changed()
+            self.restore_link(src_dpid, dst_dpid)
+            # only the link's two switches can gain (or change) next-hop ports
+            for mac in list(self.dst_hosts):
+                self.install_dst_rules(mac, dpids=(src_dpid, dst_dpid))
         # self.logger.info("Discovered link: s%s:%s <-> s%s:%s", src_dpid, src_port, dst_dpid, dst_port)
         # self.logger.info("Adjacency now: %s", dict(self.adjacency))
 
+    # ------------------ Link liveness ------------------
+    def age_links(self):
+        """Expire links not confirmed by LLDP for more than LINK_TIMEOUT_PROBES keepalive rounds."""
+        for (a, b), seen in list(self.link_seen.items()):
+            missed = self.probe_round - seen - 1
+            if missed >= self.LINK_TIMEOUT_PROBES:
+                self.expire_link(a, b, "%d probes missed" % missed)
+
+    def expire_link(self, a, b, reason):
+        """Take link a<->b out of the adjacency and the graph.
+
+        Rules forwarding over it are deleted on both ends, so reactive flows
+        are set up again from the next packet-in there, and destination rules
+        are re-pushed only for the (switch, destination) pairs whose next hops
+        changed. The edge's attributes are kept for restore_link.
+        """
+        link = (min(a, b), max(a, b))
+        self.link_seen.pop(link, None)
+        port_a = self.adjacency.get(a, {}).pop(b, None)
+        port_b = self.adjacency.get(b, {}).pop(a, None)
+        if port_a is None and port_b is None:
+            return
+        self.logger.warning("Link s%s:%s <-> s%s:%s expired (%s)", a, port_a, b, port_b, reason)
+        self.path_programs.clear()
+        self.topology_changed()
+        for dpid, port in ((a, port_a), (b, port_b)):
+            dp = self.datapaths.get(dpid)
+            if dp is not None and port is not None:
+                self.delete_flows_to_port(dp, port)
+
+        u, v = f"s{a}", f"s{b}"
+        attrs = self.graph.edge_attrs(u, v)
+        if attrs is None:
+            return
+        self.down_links[link] = attrs
+        self.repush_changed(self.graph.remove_edge(u, v))
+
+    def restore_link(self, a, b):
+        """Put a rediscovered link back into the graph (after expire_link)."""
+        attrs = self.down_links.pop((min(a, b), max(a, b)), None)
+        if attrs is None:
+            return
+        self.logger.info("Link s%s <-> s%s restored", a, b)
+        self.repush_changed(self.graph.add_edge(f"s{a}", f"s{b}", **attrs))
+
+    def delete_flow(self, datapath, fields, priority=1):
+        """Remove the flow with exactly this match and priority from a switch."""
+        parser = datapath.ofproto_parser
+        ofproto = datapath.ofproto
+        mod = parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE_STRICT,
+                                priority=priority,
+                                out_port=ofproto.OFPP_ANY,
+                                out_group=ofproto.OFPG_ANY,
+                                match=parser.OFPMatch(**fields))
+        datapath.send_msg(mod)
+
+    def delete_flows_to_port(self, datapath, port):
+        """Remove every flow that outputs to port from a switch."""
+        parser = datapath.ofproto_parser
+        ofproto = datapath.ofproto
+        mod = parser.OFPFlowMod(datapath=datapath, table_id=ofproto.OFPTT_ALL,
+                                command=ofproto.OFPFC_DELETE,
+                                out_port=port,
+                                out_group=ofproto.OFPG_ANY,
+                                match=parser.OFPMatch())
+        datapath.send_msg(mod)
+
+    # ------------------ Port statistics ------------------
+    def _port_stats_loop(self):
+        """Poll every switch's port counters (port_stats_handler turns them into link rates)."""
+        while True:
+            hub.sleep(self.PORT_STATS_INTERVAL)
+            for dp in list(self.datapaths.values()):
+                try:
+                    req = dp.ofproto_parser.OFPPortStatsRequest(dp, 0, dp.ofproto.OFPP_ANY)
+                    dp.send_msg(req)
+                except Exception as e:
+                    self.logger.exception("Failed sending port stats req to dpid=%s: %s", dp.id, e)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def port_stats_handler(self, ev):
+        """Update the measured rate of every link leaving this switch."""
+        dp = ev.msg.datapath
+        neighbor_at = {port: nbr for nbr, port in self.adjacency.get(dp.id, {}).items()}
+        for stat in ev.msg.body:
+            rate = self.port_rates.update((dp.id, stat.port_no), stat.tx_bytes,
+                                          stat.duration_sec + stat.duration_nsec * 1e-9)
+            nbr = neighbor_at.get(stat.port_no)
+            if rate is not None and nbr is not None:
+                self.graph.set_rate(f"s{dp.id}", f"s{nbr}", rate)
+
+    def link_load(self, u, v) -> float:
+        """Measured load of link u->v as a fraction of its capacity."""
+        return self.graph.link_load(u, v, self.LINK_CAPACITY_BPS)
+
+    def path_load(self, path) -> float:
+        """Load of the busiest link of path (see link_load)."""
+        return self.graph.path_load(path, self.LINK_CAPACITY_BPS)
+
+    # ------------------ Host tracking ------------------
+    def is_switch_port(self, dpid, port) -> bool:
+        """True if port on dpid leads to another switch (per LLDP adjacency)."""
+        return port in self.adjacency.get(dpid, {}).values()
+
+    def learn_host(self, mac, dpid, port) -> bool:
+        """Record where host mac is attached. Returns True if it moved.
+
+        Only host-facing ports count: frames arriving over inter-switch links
+        say nothing about where the host is. When a known host shows up on a
+        different (dpid, port), only the flows referencing its MAC are
+        deleted, on every switch, so traffic follows it on the next packet-in.
+        """
+        old = self.host_location.get(mac)
+        if old == (dpid, port) or self.is_switch_port(dpid, port):
+            return False
+
+        self.host_location[mac] = (dpid, port)
+        if old is None:
+            self.logger.info("Learned host %s at s%s:%s", mac, dpid, port)
+            if self.PROACTIVE:
+                self.install_dst_rules(mac)
+            return False
+
+        self.logger.info("Host %s moved s%s:%s -> s%s:%s, invalidating its flows",
+                         mac, old[0], old[1], dpid, port)
+        self.dst_hosts.discard(mac)
+        for dpid, dp in list(self.datapaths.items()):
+            self.dst_rules[dpid].discard(mac)
+            self.delete_flows_for_mac(dp, mac)
+        if self.PROACTIVE:
+            self.install_dst_rules(mac)
+        return True
+
+    def delete_flows_for_mac(self, datapath, mac):
+        """Remove every flow matching mac as eth_src or eth_dst (and nothing else) from a switch."""
+        parser = datapath.ofproto_parser
+        ofproto = datapath.ofproto
+        for match in (parser.OFPMatch(eth_src=mac), parser.OFPMatch(eth_dst=mac)):
+            mod = parser.OFPFlowMod(datapath=datapath, table_id=ofproto.OFPTT_ALL,
+                                    command=ofproto.OFPFC_DELETE,
+                                    out_port=ofproto.OFPP_ANY,
+                                    out_group=ofproto.OFPG_ANY,
+                                    match=match)
+            datapath.send_msg(mod)
+
+    # ------------------ Destination-keyed ECMP ------------------
+    def select_group(self, dp, ports) -> int:
+        """Id of the select group hashing over ports on dp; added to the switch on first use."""
+        ports = tuple(sorted(ports))
+        groups = self.ecmp_groups.setdefault(dp.id, {})
+        group_id = groups.get(ports)
+        if group_id is None:
+            group_id = groups[ports] = len(groups) + 1
+            parser = dp.ofproto_parser
+            ofproto = dp.ofproto
+            buckets = [parser.OFPBucket(weight=1, watch_port=port, watch_group=ofproto.OFPG_ANY,
+                                        actions=[parser.OFPActionOutput(port)])
+                       for port in ports]
+            dp.send_msg(parser.OFPGroupMod(dp, ofproto.OFPGC_ADD, ofproto.OFPGT_SELECT,
+                                           group_id, buckets))
+        return group_id
+
+    def install_dst_rules(self, mac, dpids=None) -> int:
+        """Install eth_dst=mac rules on every switch (or just dpids) with a path to the host.
+
+        Each switch forwards along its cached shortest-path next hops; with
+        ECMP_GROUPS (and config "ecmp" on) several equal-cost next hops are
+        spread by a select group shared by all destinations using the same
+        ports. A switch counts as covered (dst_rules) only once its rule is
+        sent; switches with no known next hop yet are left out and picked up
+        when LLDP finds their links. Without dpids, mac also joins dst_hosts,
+        whose rules are re-pushed on switch connect and new links. Returns
+        the number of switches programmed.
+        """
+        loc = self.host_location.get(mac)
+        if loc is None:
+            return 0
+        dst_dpid, host_port = loc
+        dst_switch = f"s{dst_dpid}"
+        if dpids is None:
+            targets = list(self.datapaths.items())
+        else:
+            targets = [(d, self.datapaths[d]) for d in dpids if d in self.datapaths]
+
+        installed = 0
+        for dpid, dp in targets:
+            parser = dp.ofproto_parser
+            if dpid == dst_dpid:
+                actions = [parser.OFPActionOutput(host_port)]
+            else:
+                links = self.adjacency.get(dpid, {})
+                ports = [links[int(nh[1:])] for nh in self.graph.next_hops(f"s{dpid}", dst_switch)
+                         if int(nh[1:]) in links]
+                if not ports:
+                    self.dst_rules[dpid].discard(mac)
+                    continue
+                if len(ports) > 1 and self.ECMP_GROUPS and self.graph.ecmp:
+                    actions = [parser.OFPActionGroup(self.select_group(dp, ports))]
+                else:
+                    actions = [parser.OFPActionOutput(ports[0])]
+            self.add_flow(dp, 1, parser.OFPMatch(eth_dst=mac), actions)
+            self.dst_rules[dpid].add(mac)
+            installed += 1
+
+        if dpids is None:
+            self.dst_hosts.add(mac)
+            self.logger.info("Destination rules for %s (s%s:%s) on %d switches",
+                             mac, dst_dpid, host_port, installed)
+        return installed
+
+    def ensure_dst_rules(self, mac) -> int:
+        """Install mac's destination rules on the connected switches that lack one."""
+        if mac not in self.dst_hosts:
+            return self.install_dst_rules(mac)
+        missing = [dpid for dpid in self.datapaths if mac not in self.dst_rules[dpid]]
+        return self.install_dst_rules(mac, dpids=missing) if missing else 0
+
+    def repush_changed(self, changed_pairs) -> int:
+        """Re-install destination rules after a graph change.
+
+        changed_pairs are the (switch, dst switch) pairs reported by
+        NetworkGraph.add_edge/remove_edge/set_weight; only hosts behind those
+        destination switches are re-pushed, and only on those switches.
+        """
+        hosts_at = defaultdict(list)  # dpid -> host macs with destination rules
+        for mac in self.dst_hosts:
+            loc = self.host_location.get(mac)
+            if loc:
+                hosts_at[loc[0]].append(mac)
+
+        pushed = 0
+        for switch, dst_switch in changed_pairs:
+            for mac in hosts_at.get(int(dst_switch[1:]), ()):
+                pushed += self.install_dst_rules(mac, dpids=(int(switch[1:]),))
+        return pushed
+
     # ------------------ Subclass hooks ------------------
     def choose_path(self, all_paths: List[List[str]]) -> List[str]:
         return all_paths[0] if all_paths else []
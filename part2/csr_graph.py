@@ -0,0 +1,307 @@
+import heapq
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from dynamic_sp import INF, SPTree
+from graph_utils import NetworkGraph
+from topology_io import load_topology
+
+
+class CSRGraph:
+    """Undirected weighted graph stored as NumPy CSR arrays over integer node ids.
+
+    Undirected edges are kept in flat per-edge arrays (edge_u, edge_v,
+    edge_w); removed edges have weight inf. The CSR view (indptr, indices,
+    weights, edge_ids) holds every live edge in both directions, sorted by
+    (node, neighbor). Re-weighting or removing an edge patches its two slots
+    in place (weight inf = removed); only new edges force a lazy rebuild.
+    """
+
+    def __init__(self, num_nodes: int, edge_u, edge_v, edge_w):
+        self.num_nodes = num_nodes
+        self.edge_u = np.asarray(edge_u, dtype=np.int32)
+        self.edge_v = np.asarray(edge_v, dtype=np.int32)
+        self.edge_w = np.asarray(edge_w, dtype=np.float64)
+        self._edge_index: Dict[Tuple[int, int], int] = {
+            self._key(u, v): i for i, (u, v) in enumerate(zip(self.edge_u.tolist(), self.edge_v.tolist()))}
+        self._dirty = True
+        self._build()
+
+    @staticmethod
+    def _key(u: int, v: int) -> Tuple[int, int]:
+        return (u, v) if u <= v else (v, u)
+
+    # ------------------ CSR construction ------------------
+    def _build(self):
+        n = self.num_nodes
+        alive = np.isfinite(self.edge_w)
+        eids = np.nonzero(alive)[0]
+        u, v, w = self.edge_u[alive], self.edge_v[alive], self.edge_w[alive]
+
+        src = np.concatenate([u, v])
+        dst = np.concatenate([v, u])
+        order = np.lexsort((dst, src))
+        self.indices = dst[order].astype(np.int32)
+        self.weights = np.concatenate([w, w])[order]
+        self.edge_ids = np.concatenate([eids, eids])[order].astype(np.int32)
+        counts = np.bincount(src, minlength=n)
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.slot_src = np.repeat(np.arange(n, dtype=np.int32), counts)  # source node of each CSR slot
+
+        # the two CSR slots of every edge id (-1: not in the CSR view)
+        self.edge_slots = np.full((len(self.edge_w), 2), -1, dtype=np.int64)
+        by_edge = np.argsort(self.edge_ids, kind="stable")
+        self.edge_slots[self.edge_ids[by_edge[0::2]], 0] = by_edge[0::2]
+        self.edge_slots[self.edge_ids[by_edge[1::2]], 1] = by_edge[1::2]
+
+        # plain lists for the (scalar, heap-driven) Dijkstra inner loop
+        self._indptr_l = self.indptr.tolist()
+        self._indices_l = self.indices.tolist()
+        self._weights_l = self.weights.tolist()
+        self._dirty = False
+
+    def _ensure_built(self):
+        if self._dirty:
+            self._build()
+
+    # ------------------ edits ------------------
+    def edge_id(self, u: int, v: int) -> int:
+        """Id of undirected edge (u,v) (live or removed), -1 if it never existed."""
+        return self._edge_index.get(self._key(u, v), -1)
+
+    def has_edge(self, u: int, v: int) -> bool:
+        eid = self.edge_id(u, v)
+        return eid >= 0 and bool(np.isfinite(self.edge_w[eid]))
+
+    def set_edge(self, u: int, v: int, weight: float) -> int:
+        """Add edge (u,v) or change its weight. Returns its id."""
+        eid = self.edge_id(u, v)
+        if eid < 0:
+            eid = len(self.edge_w)
+            self.edge_u = np.append(self.edge_u, np.int32(u))
+            self.edge_v = np.append(self.edge_v, np.int32(v))
+            self.edge_w = np.append(self.edge_w, np.float64(weight))
+            self._edge_index[self._key(u, v)] = eid
+            self._dirty = True
+        else:
+            self.edge_w[eid] = weight
+            self._patch(eid, weight)
+        return eid
+
+    def remove_edge(self, u: int, v: int) -> bool:
+        eid = self.edge_id(u, v)
+        if eid < 0 or not np.isfinite(self.edge_w[eid]):
+            return False
+        self.edge_w[eid] = np.inf
+        self._patch(eid, np.inf)
+        return True
+
+    def _patch(self, eid: int, weight: float):
+        """Write weight into the edge's CSR slots, or schedule a rebuild if it has none."""
+        if self._dirty:
+            return
+        if eid >= len(self.edge_slots) or self.edge_slots[eid, 0] < 0:
+            if np.isfinite(weight):
+                self._dirty = True
+            return
+        for k in self.edge_slots[eid].tolist():
+            self.weights[k] = weight
+            self._weights_l[k] = weight
+
+    def neighbors(self, u: int):
+        """(neighbor id, weight) of every live edge at u."""
+        self._ensure_built()
+        indices, weights = self._indices_l, self._weights_l
+        for k in range(self._indptr_l[u], self._indptr_l[u + 1]):
+            if weights[k] != INF:
+                yield indices[k], weights[k]
+
+    # ------------------ shortest paths ------------------
+    def dijkstra(self, src: int) -> np.ndarray:
+        """Distances from src to every node (inf if unreachable)."""
+        self._ensure_built()
+        indptr, indices, weights = self._indptr_l, self._indices_l, self._weights_l
+        dist = [float("inf")] * self.num_nodes
+        dist[src] = 0.0
+        heap = [(0.0, src)]
+        done = [False] * self.num_nodes
+        while heap:
+            d, u = heapq.heappop(heap)
+            if done[u]:
+                continue
+            done[u] = True
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                nd = d + weights[k]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return np.asarray(dist)
+
+    def predecessor_dag(self, src: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ECMP predecessor DAG of src's shortest-path tree.
+
+        Returns (dist, pred_indptr, pred): the equal-cost predecessors of
+        node x are pred[pred_indptr[x]:pred_indptr[x + 1]].
+        """
+        dist = self.dijkstra(src)
+        d_from = dist[self.slot_src]
+        tight = (np.isfinite(d_from) & np.isfinite(self.weights)
+                 & np.isclose(d_from + self.weights, dist[self.indices]))
+        nodes = self.indices[tight]
+        preds = self.slot_src[tight]
+        order = np.argsort(nodes, kind="stable")
+        pred_indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(nodes, minlength=self.num_nodes), out=pred_indptr[1:])
+        return dist, pred_indptr, preds[order]
+
+
+class CSRNetworkGraph(NetworkGraph):
+    """NetworkGraph backed by CSRGraph instead of networkx (config: "graph_backend": "csr").
+
+    Same public API; switches are mapped to integer ids in config order.
+    """
+
+    def build_graph_from_config(self):
+        """Build the CSR arrays straight from the config's topology (see topology_io)."""
+        self.G = None
+        topo = load_topology(self.config, self.config_dir)
+        self.nodes: List[str] = topo.nodes
+        self.node_id: Dict[str, int] = {name: i for i, name in enumerate(self.nodes)}
+        self.csr = CSRGraph(len(self.nodes), topo.src, topo.dst, topo.weight)
+
+        # per undirected edge id (0 = not configured for ports/capacity)
+        self.utilization = np.zeros(len(topo), dtype=np.float64)
+        self.capacity = topo.edges["capacity"].astype(np.float64)
+        self.src_port = topo.edges["src_port"].astype(np.int64)
+        self.dst_port = topo.edges["dst_port"].astype(np.int64)
+        self.rate = np.zeros((len(topo), 2), dtype=np.float64)  # measured bit/s: [edge_u->edge_v, edge_v->edge_u]
+        self.invalidate()
+
+    def _grow_edge_arrays(self):
+        extra = len(self.csr.edge_w) - len(self.utilization)
+        if extra > 0:
+            self.utilization = np.concatenate([self.utilization, np.zeros(extra)])
+            self.capacity = np.concatenate([self.capacity, np.zeros(extra)])
+            self.src_port = np.concatenate([self.src_port, np.zeros(extra, dtype=np.int64)])
+            self.dst_port = np.concatenate([self.dst_port, np.zeros(extra, dtype=np.int64)])
+            self.rate = np.concatenate([self.rate, np.zeros((extra, 2))])
+
+    def _ids(self, u: str, v: str) -> Optional[Tuple[int, int]]:
+        if u not in self.node_id or v not in self.node_id:
+            return None
+        return self.node_id[u], self.node_id[v]
+
+    # ------------------ topology changes ------------------
+    def add_edge(self, u: str, v: str, weight: float, **attrs) -> Set[Tuple[str, str]]:
+        w_old = self._edge_weight(u, v)
+        for name in (u, v):
+            if name not in self.node_id:
+                self.node_id[name] = len(self.nodes)
+                self.nodes.append(name)
+                self.csr.num_nodes += 1
+                self.csr._dirty = True
+        eid = self.csr.set_edge(self.node_id[u], self.node_id[v], weight)
+        self._grow_edge_arrays()
+        self.utilization[eid] = attrs.get("utilization", 0)
+        self.capacity[eid] = attrs.get("capacity") or 0
+        ports = attrs.get("ports") or {}
+        self.src_port[eid] = ports.get(self.nodes[self.csr.edge_u[eid]]) or 0
+        self.dst_port[eid] = ports.get(self.nodes[self.csr.edge_v[eid]]) or 0
+        return self._edge_changed(u, v, w_old)
+
+    def remove_edge(self, u: str, v: str) -> Set[Tuple[str, str]]:
+        w_old = self._edge_weight(u, v)
+        if w_old == INF:
+            return set()
+        self.csr.remove_edge(self.node_id[u], self.node_id[v])
+        return self._edge_changed(u, v, w_old)
+
+    def set_weight(self, u: str, v: str, weight: float) -> Set[Tuple[str, str]]:
+        w_old = self._edge_weight(u, v)
+        if w_old == INF or w_old == weight:
+            return set()
+        self.csr.set_edge(self.node_id[u], self.node_id[v], weight)
+        return self._edge_changed(u, v, w_old)
+
+    def edge_attrs(self, u: str, v: str) -> Optional[Dict]:
+        ids = self._ids(u, v)
+        if not ids or not self.csr.has_edge(*ids):
+            return None
+        eid = self.csr.edge_id(*ids)
+        attrs = {"weight": float(self.csr.edge_w[eid]), "utilization": float(self.utilization[eid])}
+        if self.capacity[eid]:
+            attrs["capacity"] = float(self.capacity[eid])
+        if self.src_port[eid] or self.dst_port[eid]:
+            a, b = self.nodes[self.csr.edge_u[eid]], self.nodes[self.csr.edge_v[eid]]
+            attrs["ports"] = {a: int(self.src_port[eid]), b: int(self.dst_port[eid])}
+        return attrs
+
+    # ------------------ graph access (backend hooks) ------------------
+    def _node_names(self) -> List[str]:
+        return list(self.nodes)
+
+    def _has_node(self, x: str) -> bool:
+        return x in self.node_id
+
+    def _edge_weight(self, u: str, v: str) -> float:
+        ids = self._ids(u, v)
+        if ids and self.csr.has_edge(*ids):
+            return float(self.csr.edge_w[self.csr.edge_id(*ids)])
+        return INF
+
+    def _neighbors(self, x: str):
+        names = self.nodes
+        return ((names[y], w) for y, w in self.csr.neighbors(self.node_id[x]))
+
+    def _sssp(self, root: str) -> SPTree:
+        """Vectorised ECMP DAG from root, converted to an SPTree keyed by name."""
+        dist, pred_indptr, pred = self.csr.predecessor_dag(self.node_id[root])
+        names = self.nodes
+        dist_l, pi, pred_l = dist.tolist(), pred_indptr.tolist(), pred.tolist()
+        reachable = np.flatnonzero(np.isfinite(dist)).tolist()
+        return SPTree(root,
+                      {names[x]: dist_l[x] for x in reachable},
+                      {names[x]: [names[p] for p in pred_l[pi[x]:pi[x + 1]]] for x in reachable})
+
+    # ------------------ utilization ------------------
+    def update_utilization(self, u: str, v: str, delta: float):
+        ids = self._ids(u, v)
+        if ids and self.csr.has_edge(*ids):
+            eid = self.csr.edge_id(*ids)
+            self.utilization[eid] = max(0.0, self.utilization[eid] + delta)
+
+    def get_utilization(self, u: str, v: str) -> float:
+        ids = self._ids(u, v)
+        if ids and self.csr.has_edge(*ids):
+            return float(self.utilization[self.csr.edge_id(*ids)])
+        return float("inf")
+
+    def get_capacity(self, u: str, v: str) -> Optional[float]:
+        ids = self._ids(u, v)
+        if ids and self.csr.has_edge(*ids):
+            return float(self.capacity[self.csr.edge_id(*ids)]) or None
+        return None
+
+    def get_port(self, u: str, v: str) -> Optional[int]:
+        ids = self._ids(u, v)
+        if not ids or not self.csr.has_edge(*ids):
+            return None
+        eid = self.csr.edge_id(*ids)
+        port = self.src_port[eid] if self.csr.edge_u[eid] == ids[0] else self.dst_port[eid]
+        return int(port) or None
+
+    def set_rate(self, u: str, v: str, bps: float):
+        ids = self._ids(u, v)
+        if ids and self.csr.has_edge(*ids):
+            eid = self.csr.edge_id(*ids)
+            self.rate[eid, 0 if self.csr.edge_u[eid] == ids[0] else 1] = bps
+
+    def get_rate(self, u: str, v: str) -> float:
+        ids = self._ids(u, v)
+        if not ids or not self.csr.has_edge(*ids):
+            return 0.0
+        eid = self.csr.edge_id(*ids)
+        return float(self.rate[eid, 0 if self.csr.edge_u[eid] == ids[0] else 1])
@@ -0,0 +1,152 @@
+"""
+Incremental shortest-path trees (Ramalingam-Reps style).
+
+An SPTree is the ECMP shortest-path DAG towards one root: dist[x] is the
+cost from x to the root and nexthops[x] the neighbors of x on some
+shortest path to it. After one undirected edge insert/delete/re-weight,
+edge_changed() repairs the tree touching only the nodes whose distance or
+next hops actually change, and returns the nodes whose next hops changed.
+
+neighbors(x) must yield (y, weight) for the graph *after* the change.
+"""
+
+import heapq
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+INF = float("inf")
+
+Neighbors = Callable[[str], Iterable[Tuple[str, float]]]
+
+
+class SPTree:
+    def __init__(self, root: str, dist: Dict[str, float], nexthops: Dict[str, List[str]]):
+        self.root = root
+        self.dist = dist
+        self.nexthops = nexthops
+
+    def edge_changed(self, u: str, v: str, w_old: float, w_new: float,
+                     neighbors: Neighbors) -> Set[str]:
+        """Repair the tree after edge (u,v) went from w_old to w_new (INF = absent)."""
+        if w_new == w_old:
+            return set()
+        before: Dict[str, List[str]] = {}  # snapshot of every next-hop list we touch
+        if w_new < w_old:
+            self._decrease(u, v, w_new, neighbors, before)
+        else:
+            self._increase(u, v, neighbors, before)
+        return {x for x, old in before.items() if set(old) != set(self.nexthops.get(x, ()))}
+
+    def _touch(self, x: str, before: Dict[str, List[str]]) -> List[str]:
+        nh = self.nexthops.setdefault(x, [])
+        if x not in before:
+            before[x] = list(nh)
+        return nh
+
+    # ------------------ shorter / new edge ------------------
+    def _decrease(self, u, v, w, neighbors: Neighbors, before):
+        dist = self.dist
+        heap = []
+        for a, b in ((u, v), (v, u)):
+            nd = dist.get(b, INF) + w
+            if nd < dist.get(a, INF):
+                self._touch(a, before)[:] = [b]
+                dist[a] = nd
+                heapq.heappush(heap, (nd, a))
+            elif nd == dist.get(a, INF) and nd < INF:
+                nh = self._touch(a, before)
+                if b not in nh:
+                    nh.append(b)
+
+        # only nodes that get strictly closer propagate
+        while heap:
+            d, x = heapq.heappop(heap)
+            if d > dist[x]:
+                continue
+            for y, wy in neighbors(x):
+                nd = d + wy
+                dy = dist.get(y, INF)
+                if nd < dy:
+                    self._touch(y, before)[:] = [x]
+                    dist[y] = nd
+                    heapq.heappush(heap, (nd, y))
+                elif nd == dy:
+                    nh = self._touch(y, before)
+                    if x not in nh:
+                        nh.append(x)
+
+    # ------------------ longer / removed edge ------------------
+    def _increase(self, u, v, neighbors: Neighbors, before):
+        dist, nexthops = self.dist, self.nexthops
+        # at most one direction of the edge can be on a shortest path
+        for a, b in ((u, v), (v, u)):
+            if b in nexthops.get(a, ()):
+                break
+        else:
+            return
+
+        self._touch(a, before).remove(b)
+        if nexthops[a]:
+            return  # a still has an equal-cost way out; distances unchanged
+
+        # affected: nodes all of whose next hops lead through an affected node
+        affected = {a}
+        queue = [a]
+        while queue:
+            x = queue.pop()
+            for y, _ in neighbors(x):
+                nh = nexthops.get(y)
+                if nh and x in nh:
+                    self._touch(y, before).remove(x)
+                    if not nh:
+                        affected.add(y)
+                        queue.append(y)
+
+        # re-seed affected nodes from their unaffected neighbors, then Dijkstra among them
+        heap = []
+        for x in affected:
+            best, nh = INF, []
+            for y, wy in neighbors(x):
+                if y in affected:
+                    continue
+                nd = dist.get(y, INF) + wy
+                if nd < best:
+                    best, nh = nd, [y]
+                elif nd == best and nd < INF:
+                    nh.append(y)
+            dist[x] = best
+            self._touch(x, before)[:] = nh
+            if best < INF:
+                heapq.heappush(heap, (best, x))
+
+        while heap:
+            d, x = heapq.heappop(heap)
+            if d > dist[x]:
+                continue
+            for y, wy in neighbors(x):
+                if y not in affected:
+                    continue
+                nd = d + wy
+                if nd < dist[y]:
+                    dist[y] = nd
+                    self._touch(y, before)[:] = [x]
+                    heapq.heappush(heap, (nd, y))
+                elif nd == dist[y]:
+                    nh = self._touch(y, before)
+                    if x not in nh:
+                        nh.append(x)
+
+    # ------------------ paths ------------------
+    def paths_from(self, src: str) -> List[List[str]]:
+        """All shortest src->root paths, following next hops."""
+        if self.dist.get(src, INF) == INF:
+            return []
+        result = []
+        stack: List[Tuple[str, List[str]]] = [(src, [src])]
+        while stack:
+            node, prefix = stack.pop()
+            if node == self.root:
+                result.append(prefix)
+                continue
+            for y in reversed(self.nexthops[node]):
+                stack.append((y, prefix + [y]))
+        return result
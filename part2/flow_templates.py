@@ -0,0 +1,176 @@
+# flow_templates.py
+# Precompiled flow-mods for path installs. Each rule is built and serialized
+# once per (switch, out port, flow class) and the rules of a path are cached
+# per (path, host ports, flow class); installing another flow of the same
+# class only patches its match values (MACs, IPs, L4 ports) and the xid into
+# copies of those bytes.
+
+import struct
+from collections import OrderedDict
+
+from ryu.lib import addrconv
+
+# OXM (OpenFlow basic class) field number -> match field whose value varies per flow
+OXM_VARIABLE = {3: "eth_dst", 4: "eth_src", 11: "ipv4_src", 12: "ipv4_dst",
+                13: "tcp_src", 14: "tcp_dst", 15: "udp_src", 16: "udp_dst"}
+OFPXMC_OPENFLOW_BASIC = 0x8000
+
+_PORT = struct.Struct("!H")
+_PACKERS = {
+    "eth_src": addrconv.mac.text_to_bin,
+    "eth_dst": addrconv.mac.text_to_bin,
+    "ipv4_src": addrconv.ipv4.text_to_bin,
+    "ipv4_dst": addrconv.ipv4.text_to_bin,
+    "tcp_src": _PORT.pack, "tcp_dst": _PORT.pack,
+    "udp_src": _PORT.pack, "udp_dst": _PORT.pack,
+}
+_REVERSE = {"eth_src": "eth_dst", "eth_dst": "eth_src",
+            "ipv4_src": "ipv4_dst", "ipv4_dst": "ipv4_src",
+            "tcp_src": "tcp_dst", "tcp_dst": "tcp_src",
+            "udp_src": "udp_dst", "udp_dst": "udp_src"}
+
+
+def match_fields(src_mac, dst_mac, src_ip=None, dst_ip=None, ip_proto=None, src_port=None, dst_port=None):
+    """OFPMatch kwargs for one direction of a flow (IPv4 and TCP/UDP fields only when known)."""
+    fields = dict(eth_src=src_mac, eth_dst=dst_mac)
+    if src_ip and dst_ip:
+        fields.update(eth_type=0x0800, ipv4_src=src_ip, ipv4_dst=dst_ip)
+    if ip_proto:
+        fields.update(ip_proto=ip_proto)
+        if src_port and dst_port:
+            if ip_proto == 6:  # TCP
+                fields.update(tcp_src=src_port, tcp_dst=dst_port)
+            elif ip_proto == 17:  # UDP
+                fields.update(udp_src=src_port, udp_dst=dst_port)
+    return fields
+
+
+def reverse_fields(fields):
+    """Match kwargs of the opposite direction (src/dst swapped)."""
+    return {_REVERSE.get(k, k): v for k, v in fields.items()}
+
+
+def flow_class(fields):
+    """Which fields a match uses, plus its constant values (eth_type, ip_proto)."""
+    return tuple(sorted(fields)), fields.get("eth_type"), fields.get("ip_proto")
+
+
+def pack_values(fields):
+    """Wire encoding of the per-flow match values."""
+    return {k: _PACKERS[k](v) for k, v in fields.items() if k in _PACKERS}
+
+
+def send_serialized(dp, buf):
+    """Send a pre-serialized OpenFlow message under the datapath's next xid."""
+    dp.xid = (dp.xid + 1) & dp.ofproto.MAX_XID
+    buf = bytearray(buf)
+    struct.pack_into("!I", buf, 4, dp.xid)
+    dp.send(bytes(buf))
+
+
+class FlowModTemplate(object):
+    """One serialized OFPFlowMod with the offsets of its per-flow match values.
+
+    Only the switch, the output port and the flow class are baked in, so a
+    template serves every flow of that class leaving the switch on that port,
+    in either direction.
+    """
+
+    __slots__ = ("dpid", "buf", "slots")
+
+    def __init__(self, dp, priority, fields, actions):
+        parser = dp.ofproto_parser
+        ofproto = dp.ofproto
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        mod = parser.OFPFlowMod(datapath=dp, priority=priority,
+                                match=parser.OFPMatch(**fields), instructions=inst)
+        mod.set_xid(0)
+        mod.serialize()
+        self.dpid = dp.id
+        self.buf = bytes(mod.buf)
+        self.slots = self._find_slots(self.buf, ofproto.OFP_FLOW_MOD_SIZE - ofproto.OFP_MATCH_SIZE)
+
+    @staticmethod
+    def _find_slots(buf, match_offset):
+        """(offset, length, field) of every variable OXM value in the serialized match."""
+        _, match_len = struct.unpack_from("!HH", buf, match_offset)
+        slots = []
+        pos, end = match_offset + 4, match_offset + match_len
+        while pos + 4 <= end:
+            oxm_class, field_hasmask, length = struct.unpack_from("!HBB", buf, pos)
+            name = OXM_VARIABLE.get(field_hasmask >> 1)
+            if oxm_class == OFPXMC_OPENFLOW_BASIC and name and not field_hasmask & 1:
+                slots.append((pos + 4, length, name))
+            pos += 4 + length
+        return tuple(slots)
+
+    def render(self, values, xid):
+        """Flow-mod bytes for one flow (values from pack_values)."""
+        buf = bytearray(self.buf)
+        struct.pack_into("!I", buf, 4, xid)
+        for offset, length, name in self.slots:
+            buf[offset:offset + length] = values[name]
+        return bytes(buf)
+
+
+class PathProgram(object):
+    """The flow-mod templates of one path, in install order (egress first)."""
+
+    __slots__ = ("rules", "hops", "complete")
+
+    def __init__(self):
+        self.rules = []        # (template, True if it carries the reverse direction)
+        self.hops = []         # (switch, next switch) pairs with a forward rule
+        self.complete = True   # False if a switch or port was unknown (then not cached)
+
+    def send(self, datapaths, fwd_values, rev_values, dpids=None):
+        """Send every rule (only those for dpids, if given); returns the dpids that got at least one."""
+        sent = []
+        for t, reverse in self.rules:
+            dp = datapaths.get(t.dpid)
+            if dp is None or (dpids is not None and t.dpid not in dpids):
+                continue
+            dp.xid = (dp.xid + 1) & dp.ofproto.MAX_XID
+            dp.send(t.render(rev_values if reverse else fwd_values, dp.xid))
+            if not sent or sent[-1] != t.dpid:
+                sent.append(t.dpid)
+        return sent
+
+
+class PathProgramCache(object):
+    """LRU of compiled PathPrograms keyed by (path, host ports, flow class),
+    over the FlowModTemplates they share, keyed by (dpid, out port, flow class)."""
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.programs = OrderedDict()
+        self.templates = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        program = self.programs.get(key)
+        if program is None:
+            self.misses += 1
+            return None
+        self.programs.move_to_end(key)
+        self.hits += 1
+        return program
+
+    def put(self, key, program):
+        self.programs[key] = program
+        self.programs.move_to_end(key)
+        while len(self.programs) > self.capacity:
+            self.programs.popitem(last=False)
+
+    def template(self, dp, out_port, fields):
+        """The (shared) template sending fields' flow class out of out_port on dp."""
+        key = (dp.id, out_port, flow_class(fields))
+        t = self.templates.get(key)
+        if t is None:
+            t = self.templates[key] = FlowModTemplate(
+                dp, 1, fields, [dp.ofproto_parser.OFPActionOutput(out_port)])
+        return t
+
+    def clear(self):
+        self.programs.clear()
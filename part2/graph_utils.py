@@ -1,49 +1,258 @@
+import heapq
 import json
+import os
 import networkx as nx
-from typing import List
+from typing import Dict, List, Optional, Set, Tuple
+
+from dynamic_sp import INF, SPTree
+
+
+def load_network_graph(config_path: str = "config.json") -> "NetworkGraph":
+    """Build the graph backend named by config "graph_backend" ("networkx" (default) or "csr")."""
+    with open(config_path, "r") as f:
+        backend = json.load(f).get("graph_backend", "networkx")
+    if backend == "csr":
+        from csr_graph import CSRNetworkGraph
+        return CSRNetworkGraph(config_path)
+    if backend != "networkx":
+        raise ValueError("unknown graph_backend %r" % backend)
+    return NetworkGraph(config_path)
 
 
 class NetworkGraph:
     def __init__(self, config_path: str = "config.json"):
         self.config = {}
+        self.config_dir = "."
         self.G = nx.Graph()
         self.ecmp = False
+        self.k_paths = 4          # k_shortest_paths defaults (config "k_paths", "path_stretch")
+        self.path_stretch = 1.5
+
+        # Shortest paths. One SPTree (ECMP DAG) per destination, built lazily
+        # and repaired incrementally on add_edge/remove_edge/set_weight; the
+        # path cache of a destination is dropped only when its next hops change.
+        # version is bumped on every edge/weight change.
+        self.version = 0
+        self._trees: Dict[str, SPTree] = {}
+        self._path_cache: Dict[str, Dict[str, List[List[str]]]] = {}  # dst -> src -> ECMP paths
+        self._ksp_cache: Dict[Tuple, List[List[str]]] = {}  # (src, dst, k, stretch) -> paths
+
         self.load_config(config_path)
         self.build_graph_from_config()
 
     def load_config(self, path: str):
-        """Load config.json (nodes, weight_matrix, ecmp flag)."""
+        """Load config.json (nodes + weight_matrix or edge_list, ecmp flag, k-shortest settings)."""
         with open(path, "r") as f:
             self.config = json.load(f)
+        self.config_dir = os.path.dirname(path)
         self.ecmp = self.config.get("ecmp", False)
+        self.k_paths = self.config.get("k_paths", self.k_paths)
+        self.path_stretch = self.config.get("path_stretch", self.path_stretch)
 
     def build_graph_from_config(self):
-        """Convert weight_matrix into a NetworkX weighted graph."""
-        nodes = self.config.get("nodes", [])
-        weight_matrix = self.config.get("weight_matrix", [])
-        self.G.add_nodes_from(nodes)
-        n = len(nodes)
-        for i in range(n):
-            for j in range(n):
-                w = weight_matrix[i][j]
-                if w and w > 0: # 0 means no connection except the diagonal
-                    self.G.add_edge(nodes[i], nodes[j], weight=w, utilization=0)
-                    # self.G[nodes[i]][nodes[j]]["utilization"] = 0.0
-                    # self.graph.update_utilization(f"s{nodes[i]}", f"s{nodes[j]}", delta=1.0)
+        """Build the NetworkX weighted graph from the config's weight_matrix or edge_list.
+
+        Edge lists are read by topology_io, which needs NumPy; it is only
+        imported for them, so dense configs work without NumPy installed.
+        """
+        edge_list = self.config.get("edge_list")
+        if edge_list:
+            from topology_io import read_edge_list
+            topo = read_edge_list(os.path.join(self.config_dir, edge_list))
+            self.G.add_nodes_from(topo.nodes)
+            self.G.add_edges_from(topo.iter_edges())
+        else:
+            nodes = self.config.get("nodes", [])
+            weight_matrix = self.config.get("weight_matrix", [])
+            self.G.add_nodes_from(nodes)
+            for i, u in enumerate(nodes):
+                for j, v in enumerate(nodes):
+                    w = weight_matrix[i][j]
+                    # 0 means no link; a later m[j][i] overrides m[i][j], as in topology_io
+                    if i != j and w and w > 0:
+                        self.G.add_edge(u, v, weight=w, utilization=0)
+        self.invalidate()
+
+    # ------------------ topology changes ------------------
+    # Each returns the set of (switch, dst) pairs whose next hops towards dst
+    # changed, over every destination computed so far.
+    def add_edge(self, u: str, v: str, weight: float, **attrs) -> Set[Tuple[str, str]]:
+        """Add (or re-weight) edge (u,v)."""
+        w_old = self._edge_weight(u, v)
+        attrs.setdefault("utilization", 0)
+        self.G.add_edge(u, v, weight=weight, **attrs)
+        return self._edge_changed(u, v, w_old)
+
+    def remove_edge(self, u: str, v: str) -> Set[Tuple[str, str]]:
+        """Remove edge (u,v) if present."""
+        if not self.G.has_edge(u, v):
+            return set()
+        w_old = self._edge_weight(u, v)
+        self.G.remove_edge(u, v)
+        return self._edge_changed(u, v, w_old)
+
+    def set_weight(self, u: str, v: str, weight: float) -> Set[Tuple[str, str]]:
+        """Change the weight of an existing edge (u,v)."""
+        if not self.G.has_edge(u, v) or self.G[u][v].get("weight") == weight:
+            return set()
+        w_old = self._edge_weight(u, v)
+        self.G[u][v]["weight"] = weight
+        return self._edge_changed(u, v, w_old)
+
+    def edge_attrs(self, u: str, v: str) -> Optional[Dict]:
+        """Weight and attributes of edge (u,v) as add_edge keywords (to restore it later), None if absent."""
+        return dict(self.G[u][v]) if self.G.has_edge(u, v) else None
+
+    def invalidate(self):
+        """Drop all shortest-path state (e.g. after editing self.G directly)."""
+        self._trees = {}
+        self._path_cache = {}
+        self._ksp_cache = {}
+        self.version += 1
+
+    def _edge_changed(self, u: str, v: str, w_old: float) -> Set[Tuple[str, str]]:
+        """Repair every computed SPTree after (u,v) changed from w_old to its current weight."""
+        self.version += 1
+        self._ksp_cache = {}
+        w_new = self._edge_weight(u, v)
+        changed = set()
+        for dst, tree in self._trees.items():
+            nodes = tree.edge_changed(u, v, w_old, w_new, self._neighbors)
+            if nodes:
+                self._path_cache.pop(dst, None)
+                changed.update((x, dst) for x in nodes)
+        return changed
+
+    # ------------------ graph access (backend hooks) ------------------
+    def _node_names(self) -> List[str]:
+        return list(self.G.nodes)
+
+    def _has_node(self, x: str) -> bool:
+        return x in self.G
+
+    def _edge_weight(self, u: str, v: str) -> float:
+        return self.G[u][v]["weight"] if self.G.has_edge(u, v) else INF
+
+    def _neighbors(self, x: str):
+        return ((y, attrs["weight"]) for y, attrs in self.G.adj[x].items())
+
+    def _sssp(self, root: str) -> SPTree:
+        """Full Dijkstra from root (undirected: predecessors are next hops towards root)."""
+        pred, dist = nx.dijkstra_predecessor_and_distance(self.G, root, weight="weight")
+        return SPTree(root, dist, pred)
+
+    # ------------------ shortest paths (cached) ------------------
+    def _tree(self, dst: str) -> SPTree:
+        tree = self._trees.get(dst)
+        if tree is None:
+            tree = self._trees[dst] = self._sssp(dst)
+        return tree
+
+    def precompute_all_pairs(self):
+        """Build the tree for every destination now instead of on first lookup."""
+        for dst in self._node_names():
+            self._tree(dst)
+
+    def next_hops(self, node: str, dst: str) -> List[str]:
+        """Neighbors of node on some shortest path to dst (its ECMP next hops)."""
+        if not self._has_node(node) or not self._has_node(dst):
+            return []
+        return self._tree(dst).nexthops.get(node, [])
 
     def dijkstra_shortest_path(self, src: str, dst: str) -> List[str]:
         """Return one shortest path from src to dst."""
-        try:
-            return nx.shortest_path(self.G, source=src, target=dst, weight="weight")
-        except nx.NetworkXNoPath:
-            return []
+        paths = self.dijkstra_all_shortest_paths(src, dst)
+        return paths[0] if paths else []
 
     def dijkstra_all_shortest_paths(self, src: str, dst: str) -> List[List[str]]:
-        """Return all equal-cost shortest paths (ECMP)."""
-        try:
-            return list(nx.all_shortest_paths(self.G, source=src, target=dst, weight="weight"))
-        except nx.NetworkXNoPath:
+        """Return all equal-cost shortest paths (ECMP).
+
+        Served from the cache; the returned lists are shared, don't mutate them.
+        """
+        if not self._has_node(src) or not self._has_node(dst):
+            return []
+        per_dst = self._path_cache.setdefault(dst, {})
+        paths = per_dst.get(src)
+        if paths is None:
+            paths = per_dst[src] = self._tree(dst).paths_from(src)
+        return paths
+
+    # ------------------ k shortest loop-free paths ------------------
+    def path_cost(self, path: List[str]) -> float:
+        """Sum of edge weights along path (inf if an edge is missing)."""
+        return sum(self._edge_weight(u, v) for u, v in zip(path, path[1:]))
+
+    def k_shortest_paths(self, src: str, dst: str, k: Optional[int] = None,
+                         stretch: Optional[float] = None) -> List[List[str]]:
+        """Up to k loop-free src->dst paths, cheapest first (Yen's algorithm).
+
+        Paths costing more than stretch times the shortest one are left out.
+        k and stretch default to the config's "k_paths" / "path_stretch".
+        Cached until the next edge change; the returned lists are shared,
+        don't mutate them.
+        """
+        k = k or self.k_paths
+        stretch = stretch or self.path_stretch
+        key = (src, dst, k, stretch)
+        paths = self._ksp_cache.get(key)
+        if paths is None:
+            paths = self._ksp_cache[key] = self._yen(src, dst, k, stretch)
+        return paths
+
+    def _yen(self, src: str, dst: str, k: int, stretch: float) -> List[List[str]]:
+        if not self._has_node(src) or not self._has_node(dst):
             return []
+        first = self._restricted_path(src, dst, set(), set())
+        if first is None:
+            return []
+        bound = first[0] * stretch + 1e-9
+        found = [first]            # (cost, path), cheapest first
+        candidates = []            # heap of (cost, path)
+        seen = {tuple(first[1])}
+        while len(found) < k:
+            prev = found[-1][1]
+            for i in range(len(prev) - 1):
+                # deviate from prev at its i-th node, keeping prev[:i+1] as the root
+                root = prev[:i + 1]
+                banned_edges = {(p[i], p[i + 1]) for _, p in found if p[:i + 1] == root}
+                spur = self._restricted_path(prev[i], dst, set(root[:-1]), banned_edges)
+                if spur is None:
+                    continue
+                cost = self.path_cost(root) + spur[0]
+                path = root[:-1] + spur[1]
+                if cost <= bound and tuple(path) not in seen:
+                    seen.add(tuple(path))
+                    heapq.heappush(candidates, (cost, path))
+            if not candidates:
+                break
+            found.append(heapq.heappop(candidates))
+        return [p for _, p in found]
+
+    def _restricted_path(self, src: str, dst: str, banned_nodes: Set[str],
+                         banned_edges: Set[Tuple[str, str]]) -> Optional[Tuple[float, List[str]]]:
+        """Cheapest src->dst path avoiding banned_nodes and the directed banned_edges, as (cost, path)."""
+        dist = {src: 0.0}
+        prev: Dict[str, str] = {}
+        heap = [(0.0, src)]
+        while heap:
+            d, x = heapq.heappop(heap)
+            if x == dst:
+                path = [x]
+                while x != src:
+                    x = prev[x]
+                    path.append(x)
+                return d, path[::-1]
+            if d > dist[x]:
+                continue
+            for y, w in self._neighbors(x):
+                if y in banned_nodes or (x, y) in banned_edges:
+                    continue
+                nd = d + w
+                if nd < dist.get(y, INF):
+                    dist[y] = nd
+                    prev[y] = x
+                    heapq.heappush(heap, (nd, y))
+        return None
 
     def update_utilization(self, u: str, v: str, delta: float):
         """Increase utilization on edge (u,v) by delta (can be negative to decrease)."""
@@ -65,6 +274,38 @@ class NetworkGraph:
         # print(v)
         return self.G[u][v].get("utilization", 0.0) if self.G.has_edge(u, v) else float("inf")
 
+    def get_capacity(self, u: str, v: str) -> Optional[float]:
+        """Configured capacity (bit/s) of edge (u,v), None if unknown."""
+        return self.G[u][v].get("capacity") if self.G.has_edge(u, v) else None
+
+    def get_port(self, u: str, v: str) -> Optional[int]:
+        """Configured port on u towards v, None if unknown."""
+        if not self.G.has_edge(u, v):
+            return None
+        return self.G[u][v].get("ports", {}).get(u)
+
+    def set_rate(self, u: str, v: str, bps: float):
+        """Record the measured traffic rate (bit/s) from u to v (e.g. from port statistics)."""
+        if self.G.has_edge(u, v):
+            self.G[u][v].setdefault("rate", {})[u] = bps
+
+    def get_rate(self, u: str, v: str) -> float:
+        """Measured traffic rate (bit/s) from u to v, 0 if never measured."""
+        return self.G[u][v].get("rate", {}).get(u, 0.0) if self.G.has_edge(u, v) else 0.0
+
+    def link_load(self, u: str, v: str, default_capacity: Optional[float] = None) -> float:
+        """Measured rate u->v as a fraction of the edge's capacity (the configured one,
+        else default_capacity; the raw rate if neither is known). inf if there is no edge."""
+        if self._edge_weight(u, v) == INF:
+            return INF
+        capacity = self.get_capacity(u, v) or default_capacity
+        rate = self.get_rate(u, v)
+        return rate / capacity if capacity else rate
+
+    def path_load(self, path: List[str], default_capacity: Optional[float] = None) -> float:
+        """Load of the busiest link along a path (see link_load)."""
+        return max((self.link_load(u, v, default_capacity) for u, v in zip(path, path[1:])), default=0.0)
+
     def path_utilization(self, path: List[str]) -> float:
         """Return total utilization along a path."""
         util = 0.0
@@ -0,0 +1,12 @@
+from p2_l2spf import ShortestPathController
+
+
+class EcmpGroupSPController(ShortestPathController):
+    """Shortest path routing with ECMP in the data plane.
+
+    Instead of picking a path per flow in the controller, every switch gets
+    one eth_dst rule per host that outputs through an OFPGT_SELECT group over
+    its equal-cost next hops, so new flows to a known host need no packet-in.
+    """
+
+    ECMP_GROUPS = True
@@ -1,25 +1,87 @@
 from base import BaseSPController
+from packet_utils import parse_headers
+from flow_templates import match_fields, reverse_fields
+from pending import flow_key, match_key
+from port_stats import CounterRates
 
-import random
 import logging
 from typing import List
 
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import MAIN_DISPATCHER, set_ev_cls
-from ryu.lib.packet import packet, ethernet, ether_types, ipv4, tcp, udp
+from ryu.lib import hub
+from ryu.lib.packet import ether_types
+
+
+class TrackedFlow(object):
+    """A flow installed along a path (forward fields; the reverse direction shares the path)."""
+    __slots__ = ("path", "fields", "hops", "moved")
+
+    def __init__(self, path, fields, hops):
+        self.path = list(path)
+        self.fields = fields
+        self.hops = list(hops)  # (u, v) links counted in the graph's utilization
+        self.moved = None  # sweep of the last migration
 
 
 class LoadBalancedSPController(BaseSPController):
     """Shortest path routing with load-based path selection and TCP/UDP/IP flow installs."""
 
+    # measured link load from port statistics (see BaseSPController)
+    PORT_STATS_INTERVAL = 1.0
+
+    # Elephant flows: every FLOW_STATS_INTERVAL seconds (0 = off) the flow
+    # counters of each flow's ingress switches are read; a direction above
+    # ELEPHANT_BPS is moved to an alternative path if that lowers its path's
+    # load by at least MIGRATION_MIN_GAIN (fraction of capacity). At most
+    # MIGRATIONS_PER_SWEEP flows move per sweep, and a moved flow stays put
+    # for MIGRATION_HOLDDOWN sweeps.
+    FLOW_STATS_INTERVAL = 5.0
+    ELEPHANT_BPS = 1e6
+    MIGRATION_MIN_GAIN = 0.1
+    MIGRATIONS_PER_SWEEP = 2
+    MIGRATION_HOLDDOWN = 3
+
+    def __init__(self, *args, **kwargs):
+        super(LoadBalancedSPController, self).__init__(*args, **kwargs)
+        self.flows = {}        # flow_key -> TrackedFlow
+        self.flow_rates = CounterRates(self.PORT_STATS_ALPHA)
+        self.sweep = 0
+        self.migrations_left = 0
+        if self.FLOW_STATS_INTERVAL:
+            self.flow_stats_thread = hub.spawn(self._flow_stats_loop)
+
+    # Path choice: candidates are the ECMP shortest paths plus the graph's k
+    # shortest loop-free paths within its stretch bound (config "k_paths",
+    # "path_stretch"); each is scored cost / shortest cost + PATH_LOAD_WEIGHT *
+    # measured load of its busiest link.
+    PATH_LOAD_WEIGHT = 2.0
+
+    def candidate_paths(self, src: str, dst: str) -> List[List[str]]:
+        """ECMP shortest paths first, then the longer k-shortest ones."""
+        paths = list(self.graph.dijkstra_all_shortest_paths(src, dst))
+        seen = {tuple(p) for p in paths}
+        paths += [p for p in self.graph.k_shortest_paths(src, dst) if tuple(p) not in seen]
+        return paths
+
+    def path_score(self, path: List[str], shortest_cost: float) -> float:
+        stretch = self.graph.path_cost(path) / shortest_cost if shortest_cost else 1.0
+        return stretch + self.PATH_LOAD_WEIGHT * self.path_load(path)
+
     def choose_path(self, all_paths: List[List[str]]) -> List[str]:
-        """Pick the path with lowest utilization."""
-        for path in all_paths:
-            print(path, self.graph.path_utilization(path))
+        """Pick the candidate with the best combined cost and measured load (see path_score).
+
+        Ties (e.g. equal-cost paths before the first statistics arrive) go to
+        the path with the fewest flows installed on it.
+        """
         if not all_paths:
             return []
-        return min(all_paths, key=lambda p: self.graph.path_utilization(p))
+        shortest = min(self.graph.path_cost(p) for p in all_paths)
+        for path in all_paths if self.logger.isEnabledFor(logging.DEBUG) else ():
+            self.logger.debug("%s cost %s load %.3f flows %s", path, self.graph.path_cost(path),
+                              self.path_load(path), self.graph.path_utilization(path))
+        return min(all_paths, key=lambda p: (self.path_score(p, shortest), self.graph.path_utilization(p)))
 
     def install_path_flows(
         self,
@@ -38,107 +100,209 @@ class LoadBalancedSPController(BaseSPController):
             return
 
         self.logger.info("Installing flows along path %s for %s -> %s", path, src_mac, dst_mac)
-        dpids = [int(s[1:]) for s in path]
 
-        dst_info = self.host_location.get(dst_mac)
-        src_info = self.host_location.get(src_mac)
-        if not dst_info or not src_info:
+        if src_mac not in self.host_location or dst_mac not in self.host_location:
             self.logger.warning("Missing host info for flow %s -> %s", src_mac, dst_mac)
             return
 
-        dst_dpid, dst_host_port = dst_info
-        src_dpid, src_host_port = src_info
-        match_kwargs = dict(eth_src=src_mac, eth_dst=dst_mac)
-        if src_ip and dst_ip:
-            match_kwargs.update(eth_type=0x0800, ipv4_src=src_ip, ipv4_dst=dst_ip)
-        if ip_proto:
-            match_kwargs.update(ip_proto=ip_proto)
-            if src_port and dst_port:
-                if ip_proto == 6:  # TCP
-                    match_kwargs.update(tcp_src=src_port, tcp_dst=dst_port)
-                elif ip_proto == 17:  # UDP
-                    match_kwargs.update(udp_src=src_port, udp_dst=dst_port)
-
-        # --- Forward & reverse flows on all intermediate switches ---
-        for i in range(len(dpids) - 1):
-            cur = dpids[i]
-            nxt = dpids[i + 1]
-            dp = self.datapaths.get(cur)
-            if not dp:
+        fields = match_fields(src_mac, dst_mac, src_ip, dst_ip, ip_proto, src_port, dst_port)
+        key = match_key(fields)
+        self.untrack_flow(key)  # set up again (e.g. after its rules were lost): replaced
+        program = self.program_path(path, fields)
+        for cur, nxt in program.hops:
+            self.graph.update_utilization(cur, nxt, delta=1.0)
+        self.flows[key] = TrackedFlow(path, fields, program.hops)
+
+    def forget_flows(self, drop, delete_rules=False):
+        """Stop tracking the flows for which drop(flow) is true, taking back their utilization.
+
+        With delete_rules, their rules (both directions) are also deleted from
+        every switch of their path, so the next packet sets them up again
+        from the ingress switch. Returns the number of flows dropped.
+        """
+        gone = [key for key, flow in self.flows.items() if drop(flow)]
+        for key in gone:
+            flow = self.untrack_flow(key)
+            if delete_rules:
+                self.delete_path_rules(flow.path, flow.fields)
+        return len(gone)
+
+    def untrack_flow(self, key):
+        """Stop tracking a flow and take its utilization back off its path. Returns it (or None)."""
+        flow = self.flows.pop(key, None)
+        if flow is not None:
+            for u, v in flow.hops:
+                self.graph.update_utilization(u, v, delta=-1.0)
+        return flow
+
+    def delete_path_rules(self, path, fields):
+        """Delete a flow's forward and reverse rules from the switches of path."""
+        for name in path:
+            dp = self.datapaths.get(int(name[1:]))
+            if dp is not None:
+                self.delete_flow(dp, fields)
+                self.delete_flow(dp, reverse_fields(fields))
+
+    def learn_host(self, mac, dpid, port) -> bool:
+        """As BaseSPController.learn_host; a moved host's tracked flows are dropped with its rules."""
+        moved = super(LoadBalancedSPController, self).learn_host(mac, dpid, port)
+        if moved:
+            self.forget_flows(lambda f: mac in (f.fields["eth_src"], f.fields["eth_dst"]))
+        return moved
+
+    def expire_link(self, a, b, reason):
+        """As BaseSPController.expire_link; flows routed over the link are dropped with their rules."""
+        u, v = f"s{a}", f"s{b}"
+        crossing = {(u, v), (v, u)}
+        # before the edge (and its utilization) is taken out of the graph
+        self.forget_flows(lambda f: not crossing.isdisjoint(zip(f.path, f.path[1:])),
+                          delete_rules=True)
+        super(LoadBalancedSPController, self).expire_link(a, b, reason)
+
+    def alternative_paths(self, src: str, dst: str) -> List[List[str]]:
+        """Candidate paths an elephant flow from src to dst may be moved to."""
+        return self.candidate_paths(src, dst)
+
+    # ------------------ Elephant flows ------------------
+    def _flow_stats_loop(self):
+        """Ask every switch where a tracked flow enters the network for its flow counters."""
+        while True:
+            hub.sleep(self.FLOW_STATS_INTERVAL)
+            self.expire_pending()  # unacknowledged migration steps roll back
+            self.sweep += 1
+            self.migrations_left = self.MIGRATIONS_PER_SWEEP
+            ingress = set()
+            for flow in self.flows.values():
+                ingress.update((flow.path[0], flow.path[-1]))
+            for name in ingress:
+                dp = self.datapaths.get(int(name[1:]))
+                if dp is not None:
+                    dp.send_msg(dp.ofproto_parser.OFPFlowStatsRequest(dp, table_id=0))
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_handler(self, ev):
+        """Rate every tracked flow direction entering at this switch; migrate the heaviest elephants."""
+        dp = ev.msg.datapath
+        name = f"s{dp.id}"
+        elephants = []
+        for stat in ev.msg.body:
+            if stat.priority != 1:
                 continue
+            fields = dict(stat.match.items())
+            if "eth_src" not in fields:
+                continue  # destination rule
+            key = match_key(fields)
+            flow = self.flows.get(key)
+            if flow is None:
+                continue
+            forward = fields["eth_src"] == flow.fields["eth_src"]
+            if name != (flow.path[0] if forward else flow.path[-1]):
+                continue  # counted where this direction enters
+            rate = self.flow_rates.update((dp.id, key, forward), stat.byte_count,
+                                          stat.duration_sec + stat.duration_nsec * 1e-9)
+            if rate is not None and rate >= self.ELEPHANT_BPS:
+                elephants.append((rate, key, forward))
+
+        for rate, key, forward in sorted(elephants, reverse=True):
+            if self.migrations_left <= 0:
+                break
+            if self.maybe_migrate(key, rate, forward):
+                self.migrations_left -= 1
+
+    def maybe_migrate(self, key, rate, forward) -> bool:
+        """Move an elephant to the alternative path with the lowest load once it is added there."""
+        flow = self.flows[key]
+        if len(flow.path) < 2 or self.pending.get(("migrate", key)) is not None:
+            return False
+        if flow.moved is not None and self.sweep - flow.moved < self.MIGRATION_HOLDDOWN:
+            return False
 
-            parser = dp.ofproto_parser
-            ofproto = dp.ofproto
-            out_port = self.adjacency.get(int(cur), {}).get(int(nxt))
-            if out_port is None:
-                self.logger.warning("No adjacency s%s -> s%s", cur, nxt)
+        # loads are per direction: look at paths in the elephant's direction
+        current = flow.path if forward else flow.path[::-1]
+        on_current = set(zip(current, current[1:]))
+        best, best_load = None, self.path_load(current) - self.MIGRATION_MIN_GAIN
+        for path in self.alternative_paths(current[0], current[-1]):
+            if path == current:
                 continue
+            load = max(self.link_load(u, v) + (0.0 if (u, v) in on_current else rate / self.link_capacity(u, v))
+                       for u, v in zip(path, path[1:]))
+            if load < best_load:
+                best, best_load = path, load
+        if best is None:
+            return False
+
+        self.logger.info("Elephant %s -> %s (%.2f Mbit/s): %s -> %s", flow.fields["eth_src"],
+                         flow.fields["eth_dst"], rate / 1e6, current, best)
+        # until the next port statistics, assume the flow's rate moves with it
+        on_best = set(zip(best, best[1:]))
+        for u, v in on_current - on_best:
+            self.graph.set_rate(u, v, max(0.0, self.graph.get_rate(u, v) - rate))
+        for u, v in on_best - on_current:
+            self.graph.set_rate(u, v, self.graph.get_rate(u, v) + rate)
+        self.migrate_flow(key, best if forward else best[::-1])
+        return True
+
+    def link_capacity(self, u, v) -> float:
+        return self.graph.get_capacity(u, v) or self.LINK_CAPACITY_BPS
+
+    def migrate_flow(self, key, new_path):
+        """Move a flow (both directions) to new_path, make-before-break.
+
+        1. rules on the switches only the new path uses (no traffic hits them yet);
+        2. once those are acknowledged, the switches on both paths are rewritten,
+           which moves the traffic over;
+        3. once those are acknowledged, the flow's tracked path and utilization
+           (over the hops new_path's program installed) move to new_path and the rules on switches only the old path used
+           are deleted.
+        If step 1 or 2 is not acknowledged in time, the migration is rolled
+        back: the shared switches are pointed at the old path again and the
+        new-only rules are deleted. A flow forgotten meanwhile (host moved,
+        link expired) just has its new-only rules deleted.
+        """
+        flow = self.flows[key]
+        old_path, fields = list(flow.path), flow.fields
+        fresh = [s for s in new_path if s not in old_path]
+        shared = [int(s[1:]) for s in new_path if s in old_path]
+        stale = [s for s in old_path if s not in new_path]
+        flow.moved = self.sweep
+
+        def tracked():
+            return self.flows.get(key) is flow
+
+        def drop_fresh():
+            # spare switches a newer setup of the same flow has put on its path
+            current = self.flows.get(key)
+            keep = set(current.path) if current is not None and current is not flow else set()
+            self.delete_path_rules([s for s in fresh if s not in keep], fields)
 
-            # Match for forward direction
-            match_kwargs = dict(eth_src=src_mac, eth_dst=dst_mac)
-            if src_ip and dst_ip:
-                match_kwargs.update(eth_type=0x0800, ipv4_src=src_ip, ipv4_dst=dst_ip)
-            if ip_proto:
-                match_kwargs.update(ip_proto=ip_proto)
-                if src_port and dst_port:
-                    if ip_proto == 6:  # TCP
-                        match_kwargs.update(tcp_src=src_port, tcp_dst=dst_port)
-                    elif ip_proto == 17:  # UDP
-                        match_kwargs.update(udp_src=src_port, udp_dst=dst_port)
-
-            match_fwd = parser.OFPMatch(**match_kwargs)
-            actions_fwd = [parser.OFPActionOutput(out_port)]
-            self.add_flow(dp, 1, match_fwd, actions_fwd)
-
-            # Reverse direction
-            if i == 0:
-                rev_out = src_host_port
-            else:
-                prev = dpids[i - 1]
-                rev_out = self.adjacency.get(int(cur), {}).get(int(prev))
-
-            if rev_out:
-                rev_kwargs = dict(eth_src=dst_mac, eth_dst=src_mac)
-                if src_ip and dst_ip:
-                    rev_kwargs.update(eth_type=0x0800, ipv4_src=dst_ip, ipv4_dst=src_ip)
-                if ip_proto:
-                    rev_kwargs.update(ip_proto=ip_proto)
-                    if src_port and dst_port:
-                        if ip_proto == 6:
-                            rev_kwargs.update(tcp_src=dst_port, tcp_dst=src_port)
-                        elif ip_proto == 17:
-                            rev_kwargs.update(udp_src=dst_port, udp_dst=src_port)
-
-                match_rev = parser.OFPMatch(**rev_kwargs)
-                actions_rev = [parser.OFPActionOutput(rev_out)]
-                self.add_flow(dp, 1, match_rev, actions_rev)
-                # self.graph.update_utilization(cur, nxt, delta=1.0)
-                self.graph.update_utilization(f"s{cur}", f"s{nxt}", delta=1.0)
-
-                print(cur)
-                print(nxt)
-                # print(f"Updated {cur}->{nxt} utilization: {self.graph.utilization.get((cur,nxt))}")
-            # self.graph.update_utilization(cur, nxt, delta=1.0)
-            self.logger.info("s%s: flows installed out:%s rev_out:%s", cur, out_port, rev_out)
-
-        # --- Final destination switch ---
-        final_switch = dpids[-1]
-        dp_final = self.datapaths.get(final_switch)
-        if dp_final:
-            parser = dp_final.ofproto_parser
-            ofproto = dp_final.ofproto
-            if dst_host_port:
-                match_fwd_final = parser.OFPMatch(**match_kwargs)
-                actions_fwd_final = [parser.OFPActionOutput(dst_host_port)]
-                self.add_flow(dp_final, 1, match_fwd_final, actions_fwd_final)
-
-            if len(dpids) >= 2:
-                prev = dpids[-2]
-                rev_out = self.adjacency.get(int(final_switch), {}).get(int(prev))
-                if rev_out:
-                    match_rev_final = parser.OFPMatch(**rev_kwargs)
-                    actions_rev_final = [parser.OFPActionOutput(rev_out)]
-                    self.add_flow(dp_final, 1, match_rev_final, actions_rev_final)
+        def roll_back():
+            self.logger.warning("Migration of %s -> %s to %s not acknowledged, rolling back",
+                                fields["eth_src"], fields["eth_dst"], new_path)
+            if tracked():
+                self.program_path(old_path, fields, dpids=shared)
+            drop_fresh()
+
+        def finish():
+            if not tracked():
+                drop_fresh()
+                return
+            for u, v in flow.hops:
+                self.graph.update_utilization(u, v, delta=-1.0)
+            for u, v in program.hops:
+                self.graph.update_utilization(u, v, delta=1.0)
+            flow.path, flow.hops = list(new_path), list(program.hops)
+            self.delete_path_rules(stale, fields)
+
+        def switch_over():
+            if not tracked():
+                drop_fresh()
+                return
+            self.program_path(new_path, fields, dpids=shared)
+            self.barrier_then(("migrate", key), shared, finish, roll_back)
+
+        fresh_dpids = [int(s[1:]) for s in fresh]
+        program = self.program_path(new_path, fields, dpids=fresh_dpids)
+        self.barrier_then(("migrate", key), fresh_dpids, switch_over, roll_back)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
@@ -149,9 +313,13 @@ class LoadBalancedSPController(BaseSPController):
         ofproto = dp.ofproto
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        eth = parse_headers(msg.data)
+        if eth is None or eth.ethertype == ether_types.ETH_TYPE_LLDP:
+            return
+
+        # LLDP is always processed (by the base class); other packet-ins count
+        # against the switch's budget
+        if not self.admit_packet_in(dp.id):
             return
 
         src, dst = eth.src, eth.dst
@@ -159,27 +327,12 @@ class LoadBalancedSPController(BaseSPController):
         self.mac_to_port.setdefault(dpid, {})
         self.mac_to_port[dpid][src] = in_port
 
-        if src not in self.host_location:
-            self.host_location[src] = (dpid, in_port)
-            self.logger.info("Learned host %s at s%s:%s", src, dpid, in_port)
+        self.learn_host(src, dpid, in_port)
 
-        ip_pkt = pkt.get_protocol(ipv4.ipv4)
-        tcp_pkt = pkt.get_protocol(tcp.tcp)
-        udp_pkt = pkt.get_protocol(udp.udp)
-
-        src_ip = dst_ip = None
-        src_port = dst_port = None
-        ip_proto = None
-
-        if ip_pkt:
-            src_ip = ip_pkt.src
-            dst_ip = ip_pkt.dst
-            ip_proto = ip_pkt.proto
-
-            if tcp_pkt:
-                src_port, dst_port = tcp_pkt.src_port, tcp_pkt.dst_port
-            elif udp_pkt:
-                src_port, dst_port = udp_pkt.src_port, udp_pkt.dst_port
+        # TCP/UDP ports are only filled in by parse_headers for those protos
+        src_ip, dst_ip = eth.ipv4_src, eth.ipv4_dst
+        ip_proto = eth.ip_proto
+        src_port, dst_port = eth.l4_src, eth.l4_dst
 
         # Flood if destination unknown
         if dst not in self.host_location:
@@ -196,10 +349,29 @@ class LoadBalancedSPController(BaseSPController):
 
         dst_dpid, _ = self.host_location[dst]
         src_switch, dst_switch = f"s{dpid}", f"s{dst_dpid}"
-        all_paths = self.graph.dijkstra_all_shortest_paths(src_switch, dst_switch)
-        path = self.choose_path(all_paths)
+        if self.PROACTIVE:
+            # destination rules are pushed ahead of traffic; this packet raced them
+            for mac in (dst, src):
+                self.ensure_dst_rules(mac)
+            if dst not in self.dst_rules[dpid]:
+                # no next hop toward dst from here yet (links still being
+                # discovered): OFPP_TABLE would only miss back to us, so flood
+                # (which also releases the switch's buffer)
+                self.logger.debug("[FLOOD] No destination rule for %s on s%s yet", dst, dpid)
+                actions = [parser.OFPActionOutput(ofproto.OFPP_FLOOD)]
+                self.send_packet_out(dp, msg.buffer_id, in_port, actions, msg.data)
+                return
+            path = None
+        else:
+            # rules for this flow (either direction) already on their way: hold the packet
+            key = flow_key(src, dst, src_ip, dst_ip, ip_proto, src_port, dst_port)
+            if self.hold_if_pending(key, msg, in_port):
+                return
+            all_paths = self.candidate_paths(src_switch, dst_switch)
+            path = self.choose_path(all_paths)
 
         if path:
+            setup = self.start_flow_setup(key)
             self.install_path_flows(
                 path,
                 src_mac=src,
@@ -210,6 +382,9 @@ class LoadBalancedSPController(BaseSPController):
                 src_port=src_port,
                 dst_port=dst_port,
             )
+            # this packet goes out once every switch on the path has acked its rules
+            self.commit_flow_setup(setup, path, msg, in_port)
+            return
 
         actions = [parser.OFPActionOutput(ofproto.OFPP_TABLE)]
         out = parser.OFPPacketOut(
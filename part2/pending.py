@@ -0,0 +1,161 @@
+# pending.py
+# Flows whose rules are still being installed, so packet-ins that race the
+# setup (later packets of the flow, or its reverse direction) are coalesced
+# instead of recomputing and reinstalling the same path.
+
+import time
+from collections import OrderedDict, deque
+
+
+def flow_key(src_mac, dst_mac, src_ip=None, dst_ip=None, ip_proto=None, src_port=None, dst_port=None):
+    """Key of a bidirectional flow: both directions map to the same key."""
+    return (ip_proto, frozenset(((src_mac, src_ip, src_port), (dst_mac, dst_ip, dst_port))))
+
+
+def match_key(fields):
+    """flow_key of an installed rule, from its OFPMatch fields."""
+    return flow_key(fields.get("eth_src"), fields.get("eth_dst"),
+                    fields.get("ipv4_src"), fields.get("ipv4_dst"), fields.get("ip_proto"),
+                    fields.get("tcp_src", fields.get("udp_src")),
+                    fields.get("tcp_dst", fields.get("udp_dst")))
+
+
+class PendingSetup(object):
+    __slots__ = ("key", "setup", "path", "started", "waiting", "queued", "coalesced", "then",
+                 "on_expire")
+
+    def __init__(self, key, started, setup=True):
+        self.key = key
+        self.setup = setup  # a flow setup (False: a barrier-only step, e.g. of a migration)
+        self.path = ()      # switch names, source first
+        self.started = started
+        self.waiting = {}   # dpid -> xid of the barrier not yet answered
+        self.queued = []    # (datapath, in_port, buffer_id, data) released on completion
+        self.coalesced = 0  # duplicate packet-ins absorbed
+        self.then = None    # called once every barrier is answered (not on expiry)
+        self.on_expire = None  # called instead of then if the entry expires
+
+
+class PendingFlows(object):
+    """Pending flow setups, completed when every switch involved answers its barrier.
+
+    Entries that are not acknowledged within timeout seconds (e.g. a switch
+    went away) are expired so the next packet-in retries the setup. The time
+    from start() to the last barrier reply is recorded per path. Barrier-only
+    steps (start(key, setup=False)) are only counted, under steps and
+    steps_expired, so they do not skew the setup counters and latencies.
+    """
+
+    def __init__(self, timeout=2.0, max_queued=32, clock=time.monotonic):
+        self.timeout = timeout
+        self.max_queued = max_queued
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> PendingSetup, oldest first
+        self.by_xid = {}              # (dpid, xid) -> key
+        self.path_latency = {}        # path -> [setups, last s, total s, max s]
+        self.recent = deque(maxlen=1000)  # latest setup latencies (s)
+
+        # counters
+        self.started = 0
+        self.completed = 0
+        self.expired = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.steps = 0
+        self.steps_expired = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def start(self, key, setup=True):
+        entry = PendingSetup(key, self.clock(), setup)
+        self.entries[key] = entry
+        if setup:
+            self.started += 1
+        return entry
+
+    def expect_barrier(self, entry, dpid, xid):
+        entry.waiting[dpid] = xid
+        self.by_xid[(dpid, xid)] = entry.key
+
+    def hold(self, entry, item):
+        """Queue a follow-up packet of a pending flow. False if the queue is full (drop it)."""
+        entry.coalesced += 1
+        self.coalesced += 1
+        if len(entry.queued) >= self.max_queued:
+            self.dropped += 1
+            return False
+        entry.queued.append(item)
+        return True
+
+    def barrier_reply(self, dpid, xid):
+        """Record a barrier reply. Returns the entry if that completed it, else None."""
+        key = self.by_xid.pop((dpid, xid), None)
+        entry = self.entries.get(key) if key is not None else None
+        if entry is None or entry.waiting.get(dpid) != xid:
+            return None
+        del entry.waiting[dpid]
+        if entry.waiting:
+            return None
+        return self.finish(entry)
+
+    def finish(self, entry):
+        """Drop a (complete) entry and record its setup latency; returns it."""
+        self.entries.pop(entry.key, None)
+        for dpid, xid in entry.waiting.items():
+            self.by_xid.pop((dpid, xid), None)
+        if not entry.setup:
+            self.steps += 1
+            return entry
+        self.completed += 1
+
+        latency = self.clock() - entry.started
+        self.recent.append(latency)
+        rec = self.path_latency.get(entry.path)
+        if rec is None:
+            self.path_latency[entry.path] = [1, latency, latency, latency]
+        else:
+            rec[0] += 1
+            rec[1] = latency
+            rec[2] += latency
+            rec[3] = max(rec[3], latency)
+        return entry
+
+    def latency(self, path):
+        """Setup latency of a path: {"setups", "last_s", "mean_s", "max_s"}, or None if never set up."""
+        rec = self.path_latency.get(tuple(path))
+        if rec is None:
+            return None
+        count, last, total, worst = rec
+        return {"setups": count, "last_s": last, "mean_s": total / count, "max_s": worst}
+
+    def expire(self, now=None):
+        """Remove and return entries older than timeout."""
+        if now is None:
+            now = self.clock()
+        expired = []
+        while self.entries:
+            entry = next(iter(self.entries.values()))
+            if now - entry.started < self.timeout:
+                break
+            self.entries.popitem(last=False)
+            for dpid, xid in entry.waiting.items():
+                self.by_xid.pop((dpid, xid), None)
+            expired.append(entry)
+            if entry.setup:
+                self.expired += 1
+            else:
+                self.steps_expired += 1
+        return expired
+
+    def stats(self):
+        recent = sorted(self.recent)
+        pick = lambda q: recent[int(q * (len(recent) - 1))] if recent else None
+        return {"pending": len(self.entries), "started": self.started,
+                "completed": self.completed, "expired": self.expired,
+                "coalesced": self.coalesced, "dropped": self.dropped,
+                "steps": self.steps, "steps_expired": self.steps_expired,
+                "setup_p50_s": pick(0.5), "setup_p99_s": pick(0.99)}
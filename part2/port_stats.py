@@ -0,0 +1,45 @@
+# port_stats.py
+# Rates from OpenFlow port and flow statistics: bit/s from the deltas between
+# successive byte counters, smoothed with an EWMA.
+
+
+class CounterRates(object):
+    """EWMA rate (bit/s) per byte counter, fed with cumulative counts.
+
+    Keys are tuples starting with the dpid, e.g. (dpid, port_no) for a
+    port's tx_bytes. Samples are timestamped with the port's or flow's own
+    duration counter, so the rate does not depend on when the reply reached
+    the controller. A counter or duration going backwards (port or flow
+    re-created, switch restarted) restarts the measurement without producing
+    a sample.
+    """
+
+    def __init__(self, alpha=0.5):
+        self.alpha = alpha   # weight of the newest sample
+        self.last = {}       # key -> (byte count, duration s)
+        self.rates = {}      # key -> smoothed bit/s
+
+    def update(self, key, byte_count, duration):
+        """Record one counter sample. Returns the smoothed rate, None until there are two samples."""
+        prev = self.last.get(key)
+        self.last[key] = (byte_count, duration)
+        if prev is None:
+            return None
+        dt = duration - prev[1]
+        delta = byte_count - prev[0]
+        if dt <= 0 or delta < 0:
+            return self.rates.get(key)
+        sample = delta * 8.0 / dt
+        old = self.rates.get(key)
+        rate = sample if old is None else self.alpha * sample + (1 - self.alpha) * old
+        self.rates[key] = rate
+        return rate
+
+    def get(self, key):
+        return self.rates.get(key, 0.0)
+
+    def forget(self, dpid, sub=None):
+        """Drop the counters of dpid (only those whose key continues with sub, if given)."""
+        for d in (self.last, self.rates):
+            for key in [k for k in d if k[0] == dpid and (sub is None or k[1] == sub)]:
+                del d[key]
@@ -0,0 +1,187 @@
+"""
+Topology loading for NetworkGraph.
+
+A topology is a list of undirected switch links with a weight and,
+optionally, the port each end uses and the link capacity (bit/s). It can
+come from:
+
+  * the dense config.json "weight_matrix" (O(n^2), kept for compatibility)
+  * a JSON-lines edge list, one object per line:
+        {"node": "s7"}                                  (optional, isolated node)
+        {"src": "s1", "dst": "s2", "weight": 10,
+         "src_port": 2, "dst_port": 1, "capacity": 1e9}  (ports/capacity optional)
+  * a compact binary edge list (see write_binary), read with one np.fromfile
+
+config.json points at an edge list with "edge_list": "<path>" (relative to
+the config file); the format is detected from the file's magic bytes.
+
+Convert a dense config:  python3 topology_io.py config.json topo.bin
+"""
+
+import json
+import os
+import sys
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+BINARY_MAGIC = b"SDNTOPO1"
+HEADER = np.dtype([("n_nodes", "<u4"), ("n_edges", "<u4"), ("names_len", "<u4")])
+EDGE_DTYPE = np.dtype([("src", "<u4"), ("dst", "<u4"), ("weight", "<f8"),
+                       ("src_port", "<u4"), ("dst_port", "<u4"), ("capacity", "<f8")])
+
+
+class Topology:
+    """Switch names plus per-edge arrays (ids index into nodes).
+
+    Port 0 and capacity 0 mean "not given". Every undirected link appears
+    once; self loops and non-positive weights are dropped.
+    """
+
+    def __init__(self, nodes: List[str], edges: np.ndarray):
+        self.nodes = nodes
+        self.edges = _dedupe(edges, len(nodes))
+
+    @property
+    def src(self) -> np.ndarray:
+        return self.edges["src"]
+
+    @property
+    def dst(self) -> np.ndarray:
+        return self.edges["dst"]
+
+    @property
+    def weight(self) -> np.ndarray:
+        return self.edges["weight"]
+
+    def __len__(self):
+        return len(self.edges)
+
+    def iter_edges(self) -> Iterator[Tuple[str, str, dict]]:
+        """(u, v, attrs) triples, e.g. for networkx add_edges_from."""
+        names = self.nodes
+        for src, dst, weight, src_port, dst_port, capacity in self.edges.tolist():
+            u, v = names[src], names[dst]
+            attrs = {"weight": weight, "utilization": 0}
+            if src_port or dst_port:
+                attrs["ports"] = {u: src_port or None, v: dst_port or None}
+            if capacity:
+                attrs["capacity"] = capacity
+            yield u, v, attrs
+
+
+def _dedupe(edges: np.ndarray, n: int) -> np.ndarray:
+    """Drop self loops / non-positive weights; keep the last entry per undirected link."""
+    edges = edges[(edges["src"] != edges["dst"]) & (edges["weight"] > 0)]
+    lo = np.minimum(edges["src"], edges["dst"]).astype(np.int64)
+    hi = np.maximum(edges["src"], edges["dst"]).astype(np.int64)
+    key = lo * max(n, 1) + hi
+    _, last = np.unique(key[::-1], return_index=True)
+    keep = np.sort(len(edges) - 1 - last)
+    return edges[keep]
+
+
+# ------------------ dense matrix ------------------
+def from_matrix(nodes: List[str], matrix) -> Topology:
+    """Topology from an n x n weight matrix (0 = no link)."""
+    n = len(nodes)
+    if not n:
+        return Topology([], np.zeros(0, dtype=EDGE_DTYPE))
+    m = np.asarray(matrix, dtype=np.float64).reshape(n, n)
+    # m[j][i] wins over m[i][j], as when both directions were added to an undirected graph
+    w = np.where(m.T > 0, m.T, m)
+    iu, ju = np.nonzero(np.triu(w > 0, k=1))
+    edges = np.zeros(len(iu), dtype=EDGE_DTYPE)
+    edges["src"], edges["dst"], edges["weight"] = iu, ju, w[iu, ju]
+    return Topology(list(nodes), edges)
+
+
+# ------------------ JSON lines ------------------
+def read_jsonl(path: str) -> Topology:
+    """Stream a JSON-lines edge list (O(E))."""
+    node_id: Dict[str, int] = {}
+    nodes: List[str] = []
+
+    def intern(name):
+        i = node_id.get(name)
+        if i is None:
+            i = node_id[name] = len(nodes)
+            nodes.append(name)
+        return i
+
+    rows = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            rec = json.loads(line)
+            if "node" in rec:
+                intern(rec["node"])
+                continue
+            rows.append((intern(rec["src"]), intern(rec["dst"]), rec.get("weight", 1),
+                         rec.get("src_port") or 0, rec.get("dst_port") or 0,
+                         rec.get("capacity") or 0))
+    return Topology(nodes, np.array(rows, dtype=EDGE_DTYPE))
+
+
+# ------------------ binary ------------------
+def write_binary(path: str, topo: Topology):
+    """Magic, header (n_nodes, n_edges, names_len), '\\n'-joined names, EDGE_DTYPE records."""
+    names = "\n".join(topo.nodes).encode("utf-8")
+    header = np.array([(len(topo.nodes), len(topo), len(names))], dtype=HEADER)
+    with open(path, "wb") as f:
+        f.write(BINARY_MAGIC)
+        f.write(header.tobytes())
+        f.write(names)
+        f.write(topo.edges.astype(EDGE_DTYPE).tobytes())
+
+
+def read_binary(path: str) -> Topology:
+    with open(path, "rb") as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError("%s: not a binary topology file" % path)
+        header = np.frombuffer(f.read(HEADER.itemsize), dtype=HEADER)[0]
+        names = f.read(int(header["names_len"])).decode("utf-8")
+        edges = np.fromfile(f, dtype=EDGE_DTYPE, count=int(header["n_edges"]))
+    nodes = names.split("\n") if names else []
+    if len(nodes) != header["n_nodes"] or len(edges) != header["n_edges"]:
+        raise ValueError("%s: truncated topology file" % path)
+    return Topology(nodes, edges)
+
+
+def read_edge_list(path: str) -> Topology:
+    """Binary or JSON-lines edge list, by magic bytes."""
+    with open(path, "rb") as f:
+        binary = f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+    return read_binary(path) if binary else read_jsonl(path)
+
+
+def load_topology(config: dict, config_dir: str = ".") -> Topology:
+    """Topology described by a loaded config.json (edge_list wins over weight_matrix)."""
+    edge_list = config.get("edge_list")
+    if edge_list:
+        return read_edge_list(os.path.join(config_dir, edge_list))
+    return from_matrix(config.get("nodes", []), config.get("weight_matrix", []))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python3 topology_io.py <config.json> <out.bin|out.jsonl>")
+    with open(sys.argv[1]) as f:
+        cfg = json.load(f)
+    topo = load_topology(cfg, os.path.dirname(sys.argv[1]))
+    out = sys.argv[2]
+    if out.endswith(".jsonl"):
+        with open(out, "w") as f:
+            for name in topo.nodes:
+                f.write(json.dumps({"node": name}) + "\n")
+            for u, v, attrs in topo.iter_edges():
+                rec = {"src": u, "dst": v, "weight": attrs["weight"]}
+                if "ports" in attrs:
+                    rec["src_port"], rec["dst_port"] = attrs["ports"][u], attrs["ports"][v]
+                if "capacity" in attrs:
+                    rec["capacity"] = attrs["capacity"]
+                f.write(json.dumps(rec) + "\n")
+    else:
+        write_binary(out, topo)
@@ -7,6 +7,7 @@ from ryu.controller import ofp_event
 from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet, ethernet, ipv4, arp, ether_types, icmp
+from packet_utils import parse_headers, IPPROTO_ICMP
 import networkx as nx
 import ipaddress
 import json
@@ -122,24 +123,21 @@ class L3ShortestPath(app_manager.RyuApp):
         dp = msg.datapath
         in_port = msg.match["in_port"]
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
+        eth = parse_headers(msg.data)
 
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        if eth is None or eth.ethertype == ether_types.ETH_TYPE_LLDP:
             return
 
-        # Handle ARP
-        arp_pkt = pkt.get_protocol(arp.arp)
-        if arp_pkt:
-            if arp_pkt.opcode == arp.ARP_REQUEST:
+        # Handle ARP (only ARP payloads go through the full parser)
+        if eth.ethertype == ether_types.ETH_TYPE_ARP:
+            arp_pkt = eth.packet().get_protocol(arp.arp)
+            if arp_pkt and arp_pkt.opcode == arp.ARP_REQUEST:
                 self.handle_arp(dp, in_port, eth, arp_pkt)
             return
 
         # Handle IPv4
-        ip_pkt = pkt.get_protocol(ipv4.ipv4)
-        if ip_pkt:
-            # MODIFIED: Pass the full 'pkt' object
-            self.handle_ipv4(dp, in_port, pkt, eth, ip_pkt)
+        if eth.ipv4_dst:
+            self.handle_ipv4(dp, in_port, eth)
 
     # --- ARP reply ----------------------------------------------------------
     def handle_arp(self, dp, in_port, eth, arp_pkt):
@@ -168,13 +166,16 @@ class L3ShortestPath(app_manager.RyuApp):
                     self.logger.info("Replied to ARP for %s from %s", dst_ip, i["mac"])
                     return
 
-    def handle_ipv4(self, dp, in_port, pkt, eth, ip_pkt):
+    def handle_ipv4(self, dp, in_port, eth):
         # Check if the packet is an ICMP request for the switch itself
-        # MODIFIED: Pass the full 'pkt' object
-        if self._handle_icmp_request(dp, pkt, eth, ip_pkt, in_port):
-            return
+        # (ICMP is the only case that needs the fully parsed packet)
+        if eth.ip_proto == IPPROTO_ICMP:
+            pkt = eth.packet()
+            if self._handle_icmp_request(dp, pkt, pkt.get_protocol(ethernet.ethernet),
+                                         pkt.get_protocol(ipv4.ipv4), in_port):
+                return
 
-        src_ip, dst_ip = ip_pkt.src, ip_pkt.dst
+        src_ip, dst_ip = eth.ipv4_src, eth.ipv4_dst
 
         src_router = self.find_router_for_ip(src_ip)
         dst_router = self.find_router_for_ip(dst_ip)
@@ -187,8 +188,8 @@ class L3ShortestPath(app_manager.RyuApp):
         self.logger.info(">>> Calculated path for %s -> %s: %s", src_ip, dst_ip, path)
         
         # Install bidirectional flows
-        self.install_path(path, ip_pkt.dst)
-        self.install_path(list(reversed(path)), ip_pkt.src)
+        self.install_path(path, dst_ip)
+        self.install_path(list(reversed(path)), src_ip)
 
 
     def install_path(self, path, dst_ip):
@@ -7,6 +7,7 @@ from ryu.controller import ofp_event
 from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet, ethernet, ipv4, arp, ether_types, icmp
+from packet_utils import parse_headers, IPPROTO_ICMP
 import networkx as nx
 import ipaddress
 import json
@@ -121,23 +122,21 @@ class L3ShortestPath(app_manager.RyuApp):
         dp = msg.datapath
         in_port = msg.match["in_port"]
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
+        eth = parse_headers(msg.data)
 
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        if eth is None or eth.ethertype == ether_types.ETH_TYPE_LLDP:
             return
 
-        # Handle ARP
-        arp_pkt = pkt.get_protocol(arp.arp)
-        if arp_pkt:
-            if arp_pkt.opcode == arp.ARP_REQUEST:
+        # Handle ARP (only ARP payloads go through the full parser)
+        if eth.ethertype == ether_types.ETH_TYPE_ARP:
+            arp_pkt = eth.packet().get_protocol(arp.arp)
+            if arp_pkt and arp_pkt.opcode == arp.ARP_REQUEST:
                 self.handle_arp(dp, in_port, eth, arp_pkt)
             return
 
         # Handle IPv4
-        ip_pkt = pkt.get_protocol(ipv4.ipv4)
-        if ip_pkt:
-            self.handle_ipv4(dp, msg, in_port, pkt, eth, ip_pkt)
+        if eth.ipv4_dst:
+            self.handle_ipv4(dp, msg, in_port, eth)
 
     def handle_arp(self, dp, in_port, eth, arp_pkt):
         parser = dp.ofproto_parser
@@ -166,9 +165,9 @@ class L3ShortestPath(app_manager.RyuApp):
                     return
 
     ## FIX ##: This entire function has been refactored for clarity and correctness.
-    def handle_ipv4(self, dp, msg, in_port, pkt, eth, ip_pkt):
+    def handle_ipv4(self, dp, msg, in_port, eth):
         # First, check if the packet is destined for one of the router's own interfaces
-        dst_ip = ip_pkt.dst
+        dst_ip = eth.ipv4_dst
         router_name_for_dst = self.find_router_for_ip(dst_ip)
         
         is_for_router = False
@@ -180,12 +179,15 @@ class L3ShortestPath(app_manager.RyuApp):
                     break
 
         # If it's for one of our interfaces, handle it as a local ICMP request
-        if is_for_router:
-            if self._handle_icmp_request(dp, pkt, eth, ip_pkt, in_port):
+        # (ICMP is the only case that needs the fully parsed packet)
+        if is_for_router and eth.ip_proto == IPPROTO_ICMP:
+            pkt = eth.packet()
+            if self._handle_icmp_request(dp, pkt, pkt.get_protocol(ethernet.ethernet),
+                                         pkt.get_protocol(ipv4.ipv4), in_port):
                 return # The ICMP request was handled, so we can stop.
         
         # If we get here, the packet is transit traffic that needs to be routed.
-        src_ip = ip_pkt.src
+        src_ip = eth.ipv4_src
         src_router = self.find_router_for_ip(src_ip)
         dst_router = self.find_router_for_ip(dst_ip)
 
@@ -5,6 +5,7 @@ from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cl
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet, ethernet, ipv4, arp, ether_types, icmp
 from ryu.topology import event
+from packet_utils import parse_headers, IPPROTO_ICMP
 import networkx as nx
 import ipaddress
 import json
@@ -132,16 +133,15 @@ class L3ShortestPathLinkFailure(app_manager.RyuApp):
         msg = ev.msg
         dp = msg.datapath
         in_port = msg.match["in_port"]
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP: return
-        arp_pkt = pkt.get_protocol(arp.arp)
-        if arp_pkt:
-            self.handle_arp(dp, in_port, eth, arp_pkt)
+        eth = parse_headers(msg.data)
+        if eth is None or eth.ethertype == ether_types.ETH_TYPE_LLDP: return
+        if eth.ethertype == ether_types.ETH_TYPE_ARP:
+            arp_pkt = eth.packet().get_protocol(arp.arp)
+            if arp_pkt:
+                self.handle_arp(dp, in_port, eth, arp_pkt)
             return
-        ip_pkt = pkt.get_protocol(ipv4.ipv4)
-        if ip_pkt:
-            self.handle_ipv4(dp, in_port, pkt, eth, ip_pkt)
+        if eth.ipv4_dst:
+            self.handle_ipv4(dp, in_port, eth)
 
     def handle_arp(self, dp, in_port, eth, arp_pkt):
         if arp_pkt.opcode != arp.ARP_REQUEST: return
@@ -160,9 +160,12 @@ class L3ShortestPathLinkFailure(app_manager.RyuApp):
                     self.logger.info("Replied to ARP for %s", dst_ip)
                     return
 
-    def handle_ipv4(self, dp, in_port, pkt, eth, ip_pkt):
-        if self._handle_icmp_request(dp, pkt, eth, ip_pkt, in_port): return
-        src_ip, dst_ip = ip_pkt.src, ip_pkt.dst
+    def handle_ipv4(self, dp, in_port, eth):
+        if eth.ip_proto == IPPROTO_ICMP:
+            pkt = eth.packet()
+            if self._handle_icmp_request(dp, pkt, pkt.get_protocol(ethernet.ethernet),
+                                         pkt.get_protocol(ipv4.ipv4), in_port): return
+        src_ip, dst_ip = eth.ipv4_src, eth.ipv4_dst
         src_router = self.find_router_for_ip(src_ip)
         dst_router = self.find_router_for_ip(dst_ip)
         if not src_router or not dst_router:
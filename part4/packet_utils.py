@@ -0,0 +1,93 @@
+# packet_utils.py
+# Fast header decoding for packet-in handlers.
+#
+# packet.Packet(msg.data) parses every protocol layer of the frame, but most
+# handlers only need the Ethernet addresses / ethertype and, sometimes, the
+# IPv4 + L4 5-tuple. parse_headers() reads exactly those fields from a
+# memoryview over msg.data with precompiled struct layouts; the full Ryu
+# parser is only run (lazily, via PacketHeaders.packet()) for ARP/ICMP/LLDP
+# payloads that actually need it.
+
+import socket
+import struct
+
+from ryu.lib.packet import packet
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_8021Q = 0x8100
+ETH_TYPE_LLDP = 0x88cc
+
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+_ETH = struct.Struct("!6s6sH")         # dst, src, ethertype
+_VLAN = struct.Struct("!HH")           # tci, inner ethertype
+_IPV4 = struct.Struct("!BBHHHBBH4s4s")  # ver/ihl ... src, dst
+_L4_PORTS = struct.Struct("!HH")       # src port, dst port (TCP and UDP)
+
+
+class PacketHeaders(object):
+    """Ethernet (+ optional IPv4/L4) header fields of a single frame."""
+
+    __slots__ = ("data", "dst", "src", "dst_bin", "src_bin", "ethertype",
+                 "ipv4_src", "ipv4_dst", "ip_proto", "l4_src", "l4_dst",
+                 "_pkt")
+
+    def __init__(self, data, dst_bin, src_bin, ethertype):
+        self.data = data
+        self.dst_bin = dst_bin
+        self.src_bin = src_bin
+        # same "aa:bb:cc:dd:ee:ff" text form that ryu's ethernet class uses
+        self.dst = dst_bin.hex(":")
+        self.src = src_bin.hex(":")
+        self.ethertype = ethertype
+        self.ipv4_src = None
+        self.ipv4_dst = None
+        self.ip_proto = None
+        self.l4_src = None
+        self.l4_dst = None
+        self._pkt = None
+
+    def packet(self):
+        """Return the fully parsed ryu Packet (parsed once, on first use)."""
+        if self._pkt is None:
+            self._pkt = packet.Packet(self.data)
+        return self._pkt
+
+
+def parse_headers(data):
+    """Decode the Ethernet/IPv4/L4 header fields of data.
+
+    Returns a PacketHeaders, or None if the frame is too short to carry an
+    Ethernet header.
+    """
+    buf = memoryview(data)
+    size = len(buf)
+    if size < _ETH.size:
+        return None
+
+    dst, src, ethertype = _ETH.unpack_from(buf, 0)
+    offset = _ETH.size
+    # skip a single 802.1Q tag so tagged frames still expose their payload type
+    if ethertype == ETH_TYPE_8021Q and size >= offset + _VLAN.size:
+        ethertype = _VLAN.unpack_from(buf, offset)[1]
+        offset += _VLAN.size
+
+    hdr = PacketHeaders(data, dst, src, ethertype)
+    if ethertype != ETH_TYPE_IP or size < offset + _IPV4.size:
+        return hdr
+
+    (ver_ihl, _tos, _total_len, _ident, flags_frag,
+     _ttl, proto, _csum, ip_src, ip_dst) = _IPV4.unpack_from(buf, offset)
+    hdr.ip_proto = proto
+    hdr.ipv4_src = socket.inet_ntoa(ip_src)
+    hdr.ipv4_dst = socket.inet_ntoa(ip_dst)
+
+    # L4 ports only exist in the first fragment
+    offset += (ver_ihl & 0x0f) * 4
+    if (proto in (IPPROTO_TCP, IPPROTO_UDP) and not flags_frag & 0x1fff and
+            size >= offset + _L4_PORTS.size):
+        hdr.l4_src, hdr.l4_dst = _L4_PORTS.unpack_from(buf, offset)
+    return hdr